@@ -74,6 +74,67 @@ def writeText(fileNameBase, className, inFileStrings, cFileStrings,
             " parsed.  Output code is in:\n" + fp.name)
     fp.close()
 
+def parse_text(text):
+    '''Returns the name and the parsed strings of a model in the plain text
+    format written by `writeText`.
+
+    Parameters
+    ----------
+    text : string
+        The contents of a model's .txt file.
+
+    Returns
+    -------
+    className : string
+        The name of the model.
+    inFileStrings : tuple
+        The integration options, parameters and states, as returned by
+        `alparsein`.
+    cFileStrings : tuple
+        The variables, constants, equations of motion, outputs, inputs,
+        linear equations, output names and dependent variables, as returned
+        by `alparsec`.
+
+    '''
+    sections = {}
+    lines = None
+    for line in text.splitlines():
+        if line.startswith('[') and line.rstrip().endswith(']'):
+            lines = sections.setdefault(line.strip()[1:-1], [])
+        elif lines is not None and line.strip():
+            # the dependent variables are already indented
+            lines.append(line.rstrip())
+
+    def section(name, units=False):
+        lines = sections.get(name, [])
+        if units:
+            # the units follow the values, e.g. "rR = 0.3, m"
+            lines = [line.split(',')[0] for line in lines]
+        return ''.join(line + '\n' for line in lines)
+
+    className = section('Name').strip()
+    intopts = section('Integration Options', units=True)
+    parameters = section('Parameters', units=True)
+    states = section('States', units=True)
+    constants = section('Constants')
+    odefunc = section('Equations of Motion')
+    outputs = section('Outputs')
+    inputs = section('Inputs')
+    linear = section('Linear')
+    outputNames = [line.strip() for line in sections.get('Output Names', [])]
+    dependentVarLines = section('Dependent Variables')
+
+    # the declaration of the zees is not in the text, the largest zee sets
+    # its size
+    zees = [int(i) for i in re.findall(r'z\[(\d+)\]', text)]
+    if zees:
+        variables = ['z[' + str(max(zees) + 1) + ']']
+    else:
+        variables = []
+
+    return className, (intopts, parameters, states), (variables, constants,
+            odefunc, outputs, inputs, linear, outputNames, dependentVarLines)
+
 def writeC(inFileStrings, cFileStrings, className):
     raise Exception
     intopts, parameters, states = inFileStrings
@@ -137,6 +198,36 @@ def write_python(inFileStrings, cFileStrings, className, matrixNames, directory=
     else:
         classFile = className
 
+    data = python_source(inFileStrings, cFileStrings, className, matrixNames)
+
+    # write the modified data to file
+    outputfile = open(classFile + '.py', 'w')
+    outputfile.write(data)
+    outputfile.close()
+
+def python_source(inFileStrings, cFileStrings, className, matrixNames):
+    '''Returns the source of the basic Python class definition.
+
+    Parameters
+    ----------
+    inFileStrings : tuple
+        The integration options, parameters and states, see `alparsein`.
+    cFileStrings : tuple
+        The variables, constants, equations of motion, outputs, inputs,
+        linear equations, output names and dependent variables, see
+        `alparsec`.
+    className : string
+        The name of the class.
+    matrixNames : tuple
+        The names of the A, B, C and D matrices in the linear equations.
+
+    Returns
+    -------
+    data : string
+        The Python source of the class and its Linear version.
+
+    '''
+
     intopts, parameters, states = inFileStrings
     variables, constants, odefunc, outputs, inputs, linear, outputNames, dependentVarLines = cFileStrings
     #print "intopts:\n", intopts
@@ -183,7 +274,15 @@ def write_python(inFileStrings, cFileStrings, className, matrixNames, directory=
     data = re.sub('<numZees>', zee_line(variables), data)
     inputNames, blah = variables_values(inputs)
     data = re.sub('<eom>', eom_lines(parDict, stateNames, inputNames, odefunc), data)
-    data = re.sub('<constants>', constants_lines(constants), data)
+    constantsText = constants_lines(constants)
+    data = re.sub('<constants>', constantsText, data)
+    data = re.sub('<constantLines>', write_list('constantLines',
+        [line.strip() for line in constantsText.splitlines()],
+        indentation=4), data)
+    data = re.sub('<constantDependencies>',
+            write_dictionary('constantDependencies',
+                constant_dependencies(constants, parDict.keys()),
+                indentation=4), data)
     data = re.sub('<dependent>', dependentVarLines, data)
 
     data = re.sub('<kinematical>', self_dot_z(extract_kinematical(odefunc,
@@ -191,26 +290,41 @@ def write_python(inFileStrings, cFileStrings, className, matrixNames, directory=
 
     constantNames, blah = variables_values(constants)
 
+    boundNames = list(parDict.keys()) + constantNames
+    data = re.sub('<boundParameterNames>', write_list('boundParameterNames',
+        boundNames, indentation=4), data)
     data = re.sub('<extractParameters>',
             create_extract_parameter_lines(parDict.keys()), data)
-    data = re.sub('<extractConstants>',
-            create_extract_parameter_lines(constantNames), data)
+    data = re.sub('<bindParameters>', create_bind_parameter_lines(boundNames),
+            data)
     data = re.sub('<extractStates>', create_extract_state_lines(stateNames), data)
+    data = re.sub('<extractBatchStates>',
+            create_extract_batch_state_lines(stateNames), data)
+    data = re.sub('<batchEom>', batch_eom_lines(inputNames, odefunc), data)
+    data = re.sub('<batchDerivatives>', batch_derivative_lines(stateNames),
+            data)
+    data = re.sub('<batchDependent>', re.sub(r'self\.z\[', 'z[',
+        dependentVarLines), data)
+    data = re.sub('<batchOutputs>', batch_output_lines(outputNames, outputs),
+            data)
     data = re.sub('<linear>', self_dot_z(replace_linear_mat(matrixNames,
         indent(linear, 8))), data)
 
-    # write the modified data to file
-    outputfile = open(classFile + '.py', 'w')
-    outputfile.write(data)
-    outputfile.close()
+    # without linear equations from Autolev the numerical linearization of
+    # LinearDynamicSystem is used
+    if linear.strip() == '':
+        data = data[:data.index('    def linear(self, x):')].rstrip() + '\n'
+
+    return data
 
 def extract_kinematical(odefun, stateNames):
-    kinematical = ''
-    for line in odefun.splitlines():
-        for state in stateNames:
-            if line.startswith(state):
-                kinematical += line + '\n'
-    return indent(kinematical, 8)
+    # keep the lines which start with a state name, matched in one pass with
+    # the longest names first so each line is kept once, e.g. for q1 and q10
+    names = sorted(stateNames, key=len, reverse=True)
+    starts = re.compile('|'.join(re.escape(name) for name in names))
+    kinematical = [line + '\n' for line in odefun.splitlines()
+            if names and starts.match(line)]
+    return indent(''.join(kinematical), 8)
 
 def zero_inputs(inputs):
     """Returns a line which sets each input variable equal to zero."""
@@ -241,6 +355,34 @@ def self_dot_z(string):
     '''Returns a string with z[x] changed to self.z[x].'''
     return re.sub('(z\[\d*\])', r'self.\1', string)
 
+# an identifier or a zee which is not part of a number or an attribute
+_identifier = re.compile(r'(?<![\w.])(z\[\d*\]|[A-Za-z_]\w*)')
+
+def substitute_identifiers(text, table, zees=''):
+    """Returns the text with the identifiers replaced in a single pass.
+
+    Parameters
+    ----------
+    text : string
+        The equations.
+    table : dictionary
+        The replacement of each identifier which should be replaced.
+    zees : string, optional
+        A prefix for the zees, e.g. 'self.' to change z[x] to self.z[x].
+
+    Returns
+    -------
+    text : string
+        The equations with the identifiers replaced.
+
+    """
+    def replace(match):
+        name = match.group(1)
+        if name.startswith('z['):
+            return zees + name
+        return table.get(name, name)
+    return _identifier.sub(replace, text)
+
 def write_list(varName, valList, indentation=0, oneLine=False):
     '''Returns a text string for a list declaration.
 
@@ -268,18 +410,20 @@ def write_list(varName, valList, indentation=0, oneLine=False):
     else:
         indent = len(listString)
         afterVar = ',\n'
+    if len(valList) == 0:
+        return listString + ']'
     for i, val in enumerate(valList):
         # if it is a string put quotes around it
         if type(val) == type('z'):
-            val = "'" + val + "'"
+            val = repr(val)
         else:
             val = str(val)
-        if i == 0:
-            listString += val + afterVar
-        elif i == len(valList) - 1:
-            listString += ' '*indent + val + ']'
+        if i > 0:
+            listString += ' '*indent
+        if i == len(valList) - 1:
+            listString += val + ']'
         else:
-            listString += ' '*indent + val + afterVar
+            listString += val + afterVar
     return listString
 
 def write_dictionary(varName, dictionary, indentation=0, oneLine=False):
@@ -310,33 +454,67 @@ def write_dictionary(varName, dictionary, indentation=0, oneLine=False):
     else:
         indent = len(dictString)
         afterVar = ',\n'
-    keyList = dictionary.keys()
-    keyList.sort()
-    for key in keyList:
+    keyList = sorted(dictionary.keys())
+    if len(keyList) == 0:
+        return dictString + '}'
+    for i, key in enumerate(keyList):
         line = "'" + key + "' : " + str(dictionary[key])
-        if key == keyList[0]:
-            dictString += line + afterVar
-        elif key == keyList[-1]:
-            dictString += ' ' * indent + line + "}"
+        if i > 0:
+            dictString += ' ' * indent
+        if i == len(keyList) - 1:
+            dictString += line + "}"
         else:
-            dictString += ' ' * indent + line + afterVar
+            dictString += line + afterVar
     return dictString
 
 def constants_lines(constants):
     print "processing constants"
     constants = constants.splitlines()
-    constantsLines = ''
-    constantList = []
+    # the constants which are not zees are stored in the parameters
+    table = {}
     for line in constants:
-        constantsLines += ' '*8 + self_dot_z(line) + '\n'
         if line[0] != 'z':
             var, trash = line.split(' = ')
-            constantList.append(var)
-    for cst in constantList:
-        constantsLines = re.sub('(\W)(' + cst + ')(\W)',
-                                r"\1self.parameters['\2']\3",
-                                constantsLines)
-    return constantsLines
+            table[var] = "self.parameters['" + var + "']"
+    constantsLines = [' '*8 + substitute_identifiers(line, table, zees='self.')
+            + '\n' for line in constants]
+    return ''.join(constantsLines)
+
+def constant_dependencies(constants, parameterNames):
+    """Returns the indices of the constant equations which depend on each
+    parameter, either directly or through other constants.
+
+    Parameters
+    ----------
+    constants : string
+        The constant equations, one per line, e.g. "d1 = c*cos(lam)".
+    parameterNames : list
+        A list of the model parameters.
+
+    Returns
+    -------
+    dependencies : dictionary
+        The keys are the parameter names and the values are sorted lists of
+        the indices of the lines which must be recalculated when that
+        parameter changes.
+
+    """
+    parameterNames = set(parameterNames)
+    # the parameters each left hand side depends on
+    depends = {}
+    dependencies = dict((p, []) for p in parameterNames)
+    for i, line in enumerate(constants.splitlines()):
+        var, expr = line.split(' = ', 1)
+        lineDepends = set()
+        for name in re.findall(r'z\[\d*\]|[A-Za-z_]\w*', expr):
+            if name in parameterNames:
+                lineDepends.add(name)
+            else:
+                lineDepends |= depends.get(name, set())
+        depends[var.strip()] = lineDepends
+        for p in lineDepends:
+            dependencies[p].append(i)
+    return dependencies
 
 def create_extract_parameter_lines(parameterNames, indentSpaces=8):
     """Returns a string of lines which extract the parameters from the
@@ -363,6 +541,48 @@ def create_extract_parameter_lines(parameterNames, indentSpaces=8):
 
     return parameterLines
 
+def create_bind_parameter_lines(parameterNames, indentSpaces=8):
+    """Returns a string of lines which unpack the parameters and constants
+    from the tuple bound by `DynamicSystem.bind_parameters`.
+
+    Parameters
+    ----------
+    parameterNames : list
+        A list of the model parameters and constants in the order of
+        `boundParameterNames`.
+
+    Returns
+    -------
+    parameterLines : string
+        A string of lines that will unpack the parameters in a single
+        statement.
+
+    """
+    indent = ' ' * indentSpaces
+
+    parameterLines = indent + '# declare the parameters\n'
+    if len(parameterNames) == 0:
+        return parameterLines
+    if len(parameterNames) == 1:
+        return (parameterLines + indent + parameterNames[0] +
+                ', = self.boundParameters\n')
+
+    # wrap the names inside the parentheses
+    lines = []
+    line = indent + '('
+    for i, name in enumerate(parameterNames):
+        if i == len(parameterNames) - 1:
+            name += ') = self.boundParameters'
+        else:
+            name += ','
+        if len(line) + len(name) + 1 > 79 and line.strip() != '(':
+            lines.append(line.rstrip())
+            line = indent + ' '
+        line += name + ' '
+    lines.append(line.rstrip())
+
+    return parameterLines + '\n'.join(lines) + '\n'
+
 def create_extract_state_lines(stateNames, indentSpaces=8):
     """Returns a string of lines which extract the parameters from the
     parameter dictionary.
@@ -413,28 +633,28 @@ def eom_lines(parameters, stateNames, inputNames, odefunc):
     indent = ' ' * 8
 
     # create the input declaration lines
-    inputLines = indent + '# calculate and declare the inputs\n'
-    inputLines += indent + 'u = self.inputs(t)\n'
+    inputLines = [indent + '# calculate and declare the inputs\n',
+                  indent + 'u = self._buffered_inputs(t)\n']
     for i, name in enumerate(inputNames):
-        inputLines += indent + name + ' = u[' + str(i) + ']\n'
+        inputLines.append(indent + name + ' = u[' + str(i) + ']\n')
 
-    # create the equation of motion lines
-    eom = odefunc.splitlines()
-    eomLines = indent + '# calculate the derivatives of the states\n'
-    # if there are zee's in the lines substute them with self.z[...]
-    for line in eom:
-        eomLines += indent + self_dot_z(line) + '\n'
+    # create the equation of motion lines, if there are zee's in the lines
+    # substute them with self.z[...]
+    eomLines = [indent + '# calculate the derivatives of the states\n']
+    for line in self_dot_z(odefunc).splitlines():
+        eomLines.append(indent + line + '\n')
 
     # create the derivatives lines
-    derivativeLines = indent + '# store the results in f and return\n'
-    derivativeLines += indent + 'f = zeros_like(x)\n'
+    derivativeLines = [indent + '# store the results in f and return\n',
+                       indent + 'if out is None:\n',
+                       indent + '    f = zeros_like(x)\n',
+                       indent + 'else:\n',
+                       indent + '    f = out\n']
     for i, name in enumerate(stateNames):
-        derivativeLines += indent + 'f[' + str(i) + '] = ' + name +'p\n'
+        derivativeLines.append(indent + 'f[' + str(i) + '] = ' + name +'p\n')
 
-    f = inputLines + '\n'
-    f += eomLines + '\n' + derivativeLines
-
-    return f
+    return ''.join(inputLines + ['\n'] + eomLines + ['\n'] +
+            derivativeLines)
 
 def zee_line(variables):
     print "processing the zee number"
@@ -466,7 +686,10 @@ def output_lines(outputNames, outputs):
 
     # create the output declarations
     oDecLines = indent + '# store the results in y and return\n'
-    oDecLines += indent + 'y = zeros(len(self.outputNames))\n'
+    oDecLines += indent + 'if out is None:\n'
+    oDecLines += indent + '    y = zeros(len(self.outputNames))\n'
+    oDecLines += indent + 'else:\n'
+    oDecLines += indent + '    y = out\n'
     for i, name in enumerate(outputNames):
         oDecLines += indent + 'y[' + str(i) + '] = ' + name + '\n'
 
@@ -474,6 +697,125 @@ def output_lines(outputNames, outputs):
 
     return outputNameLines, outputLines
 
+def batch_eom_lines(inputNames, odefunc):
+    """Returns the lines which evaluate the equations of motion for a whole
+    history of states in the `outputs_batch` method of the python file.
+
+    Parameters
+    ----------
+    inputNames : list
+        A list of the input names.
+    odefunc : string
+        A string containing the essential equations of motion of the system.
+
+    Returns
+    -------
+    eom : string
+        The lines declaring the input columns followed by the equations of
+        motion, where each zee is a row of the local array `z`.
+
+    """
+
+    indent = ' ' * 8
+
+    # create the input declaration lines
+    inputLines = indent + '# declare the inputs, one column per input\n'
+    inputLines += indent + 'if U is None:\n'
+    inputLines += indent + '    U = zeros((X.shape[0], len(self.inputNames)))\n'
+    for i, name in enumerate(inputNames):
+        inputLines += indent + name + ' = U[:, ' + str(i) + ']\n'
+
+    # create the equation of motion lines
+    eomLines = indent + '# calculate the derivatives of the states\n'
+    for line in odefunc.splitlines():
+        eomLines += indent + line + '\n'
+
+    return inputLines + '\n' + eomLines
+
+def batch_derivative_lines(stateNames):
+    """Returns the lines which store the state derivatives as the columns of
+    `F` in the `f_batch` method of the python file.
+
+    Parameters
+    ----------
+    stateNames : list
+        A list of the state names.
+
+    Returns
+    -------
+    derivativeLines : string
+        The lines which store the derivatives.
+
+    """
+    indent = ' ' * 8
+
+    derivativeLines = indent + '# store the results in F and return\n'
+    derivativeLines += indent + ('F = zeros((X.shape[0], len(self.stateNames)), '
+            'dtype=dtype)\n')
+    for i, name in enumerate(stateNames):
+        derivativeLines += indent + 'F[:, ' + str(i) + '] = ' + name + 'p\n'
+
+    return derivativeLines
+
+def batch_output_lines(outputNames, outputs):
+    """Returns the lines which calculate the outputs for a whole history of
+    states in the `outputs_batch` method of the python file.
+
+    Parameters
+    ----------
+    outputNames : list
+        A list of the output names.
+    outputs : string
+        A string containing the output equations of the system.
+
+    Returns
+    -------
+    outputLines : string
+        The output equations followed by the lines which store each output as
+        a column of `Y`.
+
+    """
+
+    indent = ' ' * 8
+
+    outputLines = ''
+    for line in outputs.splitlines():
+        outputLines += indent + line + '\n'
+
+    # create the output declarations
+    oDecLines = indent + '# store the results in Y and return\n'
+    oDecLines += indent + ('Y = zeros((X.shape[0], len(self.outputNames)), '
+            'dtype=dtype)\n')
+    for i, name in enumerate(outputNames):
+        oDecLines += indent + 'Y[:, ' + str(i) + '] = ' + name + '\n'
+
+    return outputLines + '\n' + oDecLines
+
+def create_extract_batch_state_lines(stateNames, indentSpaces=8):
+    """Returns a string of lines which extract the state histories from the
+    columns of the state array.
+
+    Parameters
+    ----------
+    stateNames : list
+        A list of the state names.
+
+    Returns
+    -------
+    extractStateLines : string
+        A string of lines that will extract the states from the columns of the
+        state array.
+
+    """
+    indent = ' ' * indentSpaces
+
+    # create the state declaration lines
+    extractStateLines = indent + '# declare the states, one column per state\n'
+    for i, name in enumerate(stateNames):
+        extractStateLines += indent + name + ' = X[:, ' + str(i) + ']\n'
+
+    return extractStateLines
+
 def input_lines(inputs):
     print "processing the inputs"
     inputs = inputs.splitlines()
@@ -1,6 +1,54 @@
 #! usr/bin/env python
 
-def write_linearization(matrices, states, inputs, outputs, holonomic=None, filename=None):
+import re
+
+def dependency_pattern(equations, names):
+    """Returns the structural dependency of each variable in a set of
+    equations on a set of names, following the intermediate variables.
+
+    Parameters
+    ----------
+    equations : string
+        The equations, one per line, e.g. "u1p = -g * sin(q1) + z[3]", in
+        the order they are evaluated. The lines of a parsed model or the
+        kinematics of an .al file can be used.
+    names : sequence of strings
+        The names to track, e.g. the states and inputs.
+
+    Returns
+    -------
+    pattern : dictionary
+        The keys are the left hand sides of the equations and the values are
+        the sets of the names which they depend on, directly or through other
+        left hand sides. The derivatives of the names are written the Autolev
+        way, e.g. "u1p" in a parsed model is the key "u1'".
+
+    """
+    names = set(names)
+    pattern = {}
+    for line in equations.splitlines():
+        if '=' not in line:
+            continue
+        lhs, rhs = line.split('=', 1)
+        lhs = _primed(lhs.strip().rstrip(';'), names)
+        depends = set()
+        for name in re.findall(r"[A-Za-z_]\w*(?:\[\d*\])?'*", rhs):
+            if name in names:
+                depends.add(name)
+            else:
+                depends |= pattern.get(_primed(name, names), set())
+        pattern[lhs] = depends
+    return pattern
+
+def _primed(name, names):
+    """Returns the name with the trailing p of the derivative of one of the
+    names, e.g. "u1p" from the generated code, written as "u1'"."""
+    if name.endswith('p') and name[:-1] in names:
+        return name[:-1] + "'"
+    return name
+
+def write_linearization(matrices, states, inputs, outputs, holonomic=None,
+        filename=None, pattern=None):
     """Returns the text for jacobian calculations for the system matrices for
     Autolev.
 
@@ -19,7 +67,15 @@ def write_linearization(matrices, states, inputs, outputs, holonomic=None, filen
         The name of the holonomic constraint equation and the independent
         coordinate.
     filename : string
-        The path to a file where the resulting text will be saved.
+        The path to a file where the resulting text will be saved. The text
+        is written as it is generated.
+    pattern : dictionary, optional
+        The structural dependencies of the rows, see `dependency_pattern`.
+        The keys are the state derivatives (e.g. "u1'"), the outputs and the
+        holonomic constraint, and the values are the sets of states and inputs
+        they depend on. Partials of a key with respect to a variable which is
+        not in its set are written as zero instead of being differentiated by
+        Autolev. Rows which are not keys are assumed to depend on everything.
 
     Returns
     -------
@@ -28,55 +84,70 @@ def write_linearization(matrices, states, inputs, outputs, holonomic=None, filen
 
     """
 
+    if pattern is not None:
+        names = set(states) | set(inputs)
+        pattern = dict((_primed(row, names), cols) for row, cols in
+                pattern.items())
+
+    def depends(row, col):
+        if pattern is None or row not in pattern:
+            return True
+        return col in pattern[row]
+
     def derivative(matrix, i, j, row, col, holonomic, prime=False):
         if prime is True:
-            prime = "'"
-        else:
-            prime = ''
-        partial = (matrix + '[' + str(i + 1) + ', ' + str(j + 1) + '] = d(' +
-                row + prime + ', ' + col + ')')
+            row = row + "'"
+        terms = []
+        if depends(row, col):
+            terms.append('d(' + row + ', ' + col + ')')
         if holonomic is not None:
             dependent = holonomic[0]
             constraint = holonomic[1]
-            chainrule = (' + d(' + row + prime + ', ' + dependent + ') * d(' +
-                constraint + ', ' + col + ') / d(' + constraint + ', ' + dependent
-                + ')')
-        else:
-            chainrule = ''
-        return partial + chainrule + '\n'
-
-    text = ''
-    # state matrix
-    for i, row in enumerate(states):
-        for j, col in enumerate(states):
-            text += derivative(matrices[0], i, j, row, col, holonomic, prime=True)
-        text += '\n'
-
-    # input matrix
-    for i, row in enumerate(states):
-        for j, col in enumerate(inputs):
-            text += derivative(matrices[1], i, j, row, col, holonomic, prime=True)
-        text += '\n'
-
-    # output matrix
-    for i, row in enumerate(outputs):
-        for j, col in enumerate(states):
-            text += derivative(matrices[2], i, j, row, col, holonomic)
-        text += '\n'
-
-    # feed forward matrix
-    for i, row in enumerate(outputs):
-        for j, col in enumerate(inputs):
-            text += derivative(matrices[3], i, j, row, col, holonomic)
-        text += '\n'
-
-    text += 'encode '
-    for x in matrices[:-1]:
-        text += x + ', '
-    text += matrices[-1]
+            if depends(row, dependent) and depends(constraint, col):
+                terms.append('d(' + row + ', ' + dependent + ') * d(' +
+                    constraint + ', ' + col + ') / d(' + constraint + ', ' +
+                    dependent + ')')
+        if not terms:
+            terms.append('0')
+        return (matrix + '[' + str(i + 1) + ', ' + str(j + 1) + '] = ' +
+                ' + '.join(terms) + '\n')
+
+    def lines():
+        # state matrix
+        for i, row in enumerate(states):
+            for j, col in enumerate(states):
+                yield derivative(matrices[0], i, j, row, col, holonomic,
+                        prime=True)
+            yield '\n'
+
+        # input matrix
+        for i, row in enumerate(states):
+            for j, col in enumerate(inputs):
+                yield derivative(matrices[1], i, j, row, col, holonomic,
+                        prime=True)
+            yield '\n'
+
+        # output matrix
+        for i, row in enumerate(outputs):
+            for j, col in enumerate(states):
+                yield derivative(matrices[2], i, j, row, col, holonomic)
+            yield '\n'
+
+        # feed forward matrix
+        for i, row in enumerate(outputs):
+            for j, col in enumerate(inputs):
+                yield derivative(matrices[3], i, j, row, col, holonomic)
+            yield '\n'
+
+        yield 'encode ' + ', '.join(matrices)
 
+    text = []
     if filename is not None:
         with open(filename, 'w') as f:
-            f.write(text)
+            for line in lines():
+                f.write(line)
+                text.append(line)
+    else:
+        text = list(lines())
 
-    return text
+    return ''.join(text)
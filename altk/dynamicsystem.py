@@ -1,18 +1,37 @@
+import collections
+import hashlib
+import inspect
 import itertools
 import numpy as np
 from numpy.linalg import eig
-from scipy.integrate import odeint
-import matplotlib.pyplot as plt
-import pickle
 import os
-
-# debugging
-try:
-    from IPython.core.debugger import Tracer
-except ImportError:
-    pass
-else:
-    set_trace = Tracer()
+import sys
+import time
+import weakref
+
+# scipy, matplotlib, pickle and multiprocessing are imported where they are
+# used so that evaluating a model, e.g. in a headless worker, does not pay
+# for their import
+
+def _pyplot():
+    """Returns matplotlib.pyplot, importing it the first time it is
+    needed."""
+    import matplotlib.pyplot as plt
+    return plt
+
+def set_trace():
+    """Starts the debugger in the frame of the caller, IPython's if it is
+    installed."""
+    frame = sys._getframe().f_back
+    try:
+        from IPython.core.debugger import Pdb
+    except ImportError:
+        from pdb import Pdb
+    Pdb().set_trace(frame)
+
+# the compiled constant lines of each model class, which do not keep classes
+# that are no longer used alive, e.g. after a model is reloaded
+_compiledConstants = weakref.WeakKeyDictionary()
 
 class DynamicSystem(object):
     """
@@ -37,6 +56,17 @@ class DynamicSystem(object):
     parameters = {'a' : 1.0,
                   'b' : 2.0}
 
+    # the lines of the constants method and the indices of the lines which
+    # depend on each parameter, generated models set these so that only the
+    # affected constants are recalculated when some of the parameters change
+    constantLines = []
+    constantDependencies = {}
+
+    # the parameters and constants in the order that the equations of motion
+    # unpack them from `boundParameters`
+    boundParameterNames = ['a',
+                           'b']
+
     # state names
     stateNames = ['x1',
                   'x2']
@@ -67,7 +97,90 @@ class DynamicSystem(object):
     # sets the time to the initial time
     t = intOpts['ti']
 
-    def f(self, x, t):
+    # the number of samples evaluated together by the batch methods
+    batchSize = 1000
+
+    # the methods timed by enable_profiling
+    profiledMethods = ['constants', 'update_constants', 'f', 'inputs',
+                       'outputs', 'f_batch', 'outputs_batch', 'linear',
+                       'simulate']
+
+    # the integrator used by simulate, either 'odeint' or 'rk4' for fixed
+    # steps, and the number of fixed steps taken between output samples
+    integrator = 'odeint'
+    fixedSteps = 1
+
+    def __init__(self):
+        '''Sets the constants and the buffer that f reuses for the inputs.'''
+        self.inputBuffer = np.zeros(len(self.inputNames))
+        self.constants()
+
+    def constants(self):
+        '''Sets the zees that are constant.'''
+        self.bind_parameters()
+
+    def bind_parameters(self):
+        """Stores the values of the parameters and constants as a tuple
+        ordered by `boundParameterNames`.
+
+        Notes
+        -----
+        The equations of motion unpack this tuple instead of looking up each
+        parameter in the dictionary on every call. It is rebuilt whenever the
+        constants are calculated, so change the parameters with
+        `set_parameters` rather than editing `parameters` directly. The values
+        of the parameters are also recorded for `update_constants`, since
+        every way of calculating the constants ends here.
+
+        """
+        parameters = self.parameters
+        self.boundParameters = tuple(parameters[p] for p in
+                self.boundParameterNames)
+        self._constantsParameters = dict((p, parameters[p]) for p in
+                self.constantDependencies)
+
+    def update_constants(self, names=None):
+        """Recalculates the constants which depend on the parameters that
+        have changed since the constants were last updated.
+
+        Parameters
+        ----------
+        names : list, optional
+            The names of the changed parameters. If not given, the changed
+            parameters are found by comparing the current values with those
+            used for the last update.
+
+        Notes
+        -----
+        All of the constants are recalculated the first time this is called
+        or if the model does not provide `constantDependencies`.
+
+        """
+        previous = self.__dict__.get('_constantsParameters')
+        if previous is None or not self.constantDependencies:
+            self.constants()
+        else:
+            if names is None:
+                names = [p for p in self.constantDependencies if
+                        self.parameters[p] != previous[p]]
+            lines = sorted(set(i for p in names for i in
+                self.constantDependencies.get(p, [])))
+            if lines:
+                code = _compiled_constants(self.__class__)
+                try:
+                    namespace = dict(sys.modules[self.__module__].__dict__)
+                except KeyError:
+                    # the module of a reloaded model is no longer registered
+                    namespace = dict(
+                            type(self).constants.__func__.__globals__)
+                for p in self.constantDependencies:
+                    namespace[p] = self.parameters[p]
+                namespace['self'] = self
+                for i in lines:
+                    exec(code[i], namespace)
+            self.bind_parameters()
+
+    def f(self, x, t, out=None):
         '''
         Returns the derivative of the states at the specified time.
 
@@ -77,6 +190,8 @@ class DynamicSystem(object):
             The state vector at this time.
         t : float
             Time.
+        out : ndarray, shape(n,), optional
+            If given, the derivatives are stored in this array.
 
         Returns
         -------
@@ -86,15 +201,14 @@ class DynamicSystem(object):
         '''
 
         # declare the parameters
-        a = self.parameters['a']
-        b = self.parameters['b']
+        a, b = self.boundParameters
 
         # declare the states
         x1 = x[0]
         x2 = x[1]
 
         # calculates and declare the inputs
-        u = self.inputs(t)
+        u = self._buffered_inputs(t)
         F1 = u[0]
 
         # calculate the zees
@@ -105,12 +219,32 @@ class DynamicSystem(object):
         x2p = a * 1. + b * F1
 
         # store the results in f and return
-        f = np.zeros_like(x)
+        if out is None:
+            f = np.zeros_like(x)
+        else:
+            f = out
         f[0] = x1p
         f[1] = x2p
 
         return f
 
+    def _buffered_inputs(self, t):
+        """Returns the inputs at time t, stored in `inputBuffer` if the input
+        source takes an `out` argument. Overrides of `inputs` and input
+        functions assigned directly may only take the time, so which form to
+        call is found once for each source."""
+        inputs = self.inputs
+        source = getattr(inputs, '__func__', None)
+        if source is None:
+            source = inputs if inspect.isfunction(inputs) else type(inputs)
+        form = self.__dict__.get('_inputsForm')
+        if form is None or form[0] is not source:
+            form = (source, _accepts_out(inputs))
+            self._inputsForm = form
+        if form[1]:
+            return inputs(t, out=self.inputBuffer)
+        return inputs(t)
+
     def get_sim_output(self, outputName):
         """Returns the time history of the specified output from the latest
         simulation.
@@ -129,13 +263,15 @@ class DynamicSystem(object):
 
         return self.simResults['y'][:, self.outputNames.index(outputName)]
 
-    def inputs(self, t):
+    def inputs(self, t, out=None):
         '''Returns the inputs to the system.
 
         Parameters
         ----------
         t : float
             Time.
+        out : ndarray, shape(m,), optional
+            If given, the inputs are stored in this array.
 
         Returns
         -------
@@ -144,12 +280,15 @@ class DynamicSystem(object):
 
         '''
         # initialize the input array
-        u = np.zeros(len(self.inputNames))
+        if out is None:
+            u = np.zeros(len(self.inputNames))
+        else:
+            u = out
         # calculate or specifiy the input vector
         u[0] = 1.
         return u
 
-    def outputs(self, x):
+    def outputs(self, x, out=None):
         '''
         Returns the outputs of the system.
 
@@ -157,6 +296,8 @@ class DynamicSystem(object):
         ----------
         x : ndarray, shape(n,)
             The current state vector.
+        out : ndarray, shape(m,), optional
+            If given, the outputs are stored in this array.
 
         Returns
         -------
@@ -164,12 +305,102 @@ class DynamicSystem(object):
             The output vector.
 
         '''
-        y = np.zeros(len(self.outputNames))
+        if out is None:
+            y = np.zeros(len(self.outputNames))
+        else:
+            y = out
         y[0] = x[0]
         y[1] = x[1]
 
         return y
 
+    def f_batch(self, X, U=None):
+        '''Returns the time derivatives of many state vectors at once.
+
+        Parameters
+        ----------
+        X : ndarray, shape(k, n)
+            The state vectors, one per row.
+        U : ndarray, shape(k, m), optional
+            The input vectors, one per row. The inputs are zero if not given.
+
+        Returns
+        -------
+        F : ndarray, shape(k, n)
+            The time derivatives of the state vectors, one per row.
+
+        Notes
+        -----
+        This evaluates `f` for each row. Generated models override it with a
+        vectorized version.
+
+        '''
+        if U is None:
+            U = np.zeros((X.shape[0], len(self.inputNames)))
+
+        F = np.zeros((X.shape[0], len(self.stateNames)))
+        out = _accepts_out(self.f)
+        inputs = self.__dict__.get('inputs')
+        try:
+            for i, x in enumerate(X):
+                self.inputs = HeldInputs(U[i])
+                if out:
+                    self.f(x, self.t, out=F[i])
+                else:
+                    F[i] = self.f(x, self.t)
+        finally:
+            self.set_input_source(inputs)
+
+        return F
+
+    def outputs_batch(self, X, U=None):
+        '''Returns the outputs of the system for a whole history of states.
+
+        Parameters
+        ----------
+        X : ndarray, shape(k, n)
+            The state vectors, one per row.
+        U : ndarray, shape(k, m), optional
+            The input vectors, one per row. The inputs are zero if not given.
+
+        Returns
+        -------
+        Y : ndarray, shape(k, p)
+            The output vectors, one per row.
+
+        Notes
+        -----
+        This evaluates `f` and `outputs` for each row so that the zees the
+        outputs depend on are set for that state. Generated models override it
+        with a vectorized version.
+
+        '''
+        if U is None:
+            U = np.zeros((X.shape[0], len(self.inputNames)))
+
+        Y = np.zeros((X.shape[0], len(self.outputNames)))
+        out = _accepts_out(self.outputs)
+        if _accepts_out(self.f):
+            derivatives = np.zeros(X.shape[1])
+        else:
+            derivatives = None
+        inputs = self.__dict__.get('inputs')
+        try:
+            for i, x in enumerate(X):
+                self.inputs = HeldInputs(U[i])
+                if derivatives is None:
+                    self.f(x, self.t)
+                else:
+                    self.f(x, self.t, out=derivatives)
+                if out:
+                    self.outputs(x, out=Y[i])
+                else:
+                    Y[i] = self.outputs(x)
+        finally:
+            self.set_input_source(inputs)
+
+        return Y
+
     def set_initial_conditions(self, *args):
         """Sets a given initial condition.
 
@@ -198,6 +429,57 @@ class DynamicSystem(object):
 
             self.initialConditions[index] = val
 
+    def set_input_source(self, source):
+        """Replaces the `inputs` method of the system with a callable.
+
+        Parameters
+        ----------
+        source : callable or None
+            A function of time which returns the input vector. If it takes an
+            `out` argument, it is passed the array to store the inputs in. If
+            None, the model's own `inputs` method is restored.
+
+        """
+        if source is None:
+            self.__dict__.pop('inputs', None)
+        elif _accepts_out(source):
+            self.inputs = source
+        else:
+            self.inputs = lambda t, out=None: source(t)
+
+    def set_input_table(self, t, u):
+        """Drives the system with sampled input histories, e.g. a measured
+        steer torque, which are linearly interpolated in time.
+
+        Parameters
+        ----------
+        t : array_like, shape(k,)
+            The increasing sample times.
+        u : array_like, shape(k, m)
+            The input vectors at each sample time. The columns are in the
+            order of `inputNames`.
+
+        Returns
+        -------
+        source : TabulatedInputs
+            The input source, its `evaluate` method gives the inputs at many
+            times at once.
+
+        Notes
+        -----
+        Use `set_input_source(None)` to restore the model's own inputs.
+
+        """
+        u = np.asarray(u, dtype=float)
+        if u.ndim == 1:
+            u = u[:, np.newaxis]
+        if u.shape[1] != len(self.inputNames):
+            raise ValueError('The input table has {} columns but the model '
+                    'has {} inputs.'.format(u.shape[1], len(self.inputNames)))
+        source = TabulatedInputs(t, u)
+        self.set_input_source(source)
+        return source
+
     def set_parameters(self, par):
         """Sets the parameters with the given dictionary.
 
@@ -214,8 +496,9 @@ class DynamicSystem(object):
                 print('{}'.format(p) + ' was not in the provided ' +
                         'parameters and thus was not set.')
 
-        # recalculate the constants
-        self.constants()
+        # recalculate the constants which depend on the parameters that
+        # changed since the last update, including any edited directly
+        self.update_constants()
 
     def simulate(self):
         '''
@@ -232,49 +515,33 @@ class DynamicSystem(object):
         self.constants()
 
         # time vector
-        t = np.linspace(self.intOpts['ti'],
-                        self.intOpts['tf'] - self.intOpts['ts'],
-                        (self.intOpts['tf'] - self.intOpts['ti']) / self.intOpts['ts'])
-
-        #print self.stateNames
-        #print self.outputNames
-        #print self.inputNames
+        t = self.time_vector()
 
         # initialize the vectors
         x = np.zeros((len(t), len(self.x)))
         u = np.zeros((len(t), len(self.u)))
         y = np.zeros((len(t), len(self.y)))
 
-        # set the initial conditions
-        x[0] = self.initialConditions
-        u[0] = self.inputs(t[0])
-        y[0] = self.outputs(x[0])
+        # the inputs are stored straight into u if the model allows it
+        out = _accepts_out(self.inputs)
 
-        for i in range(len(t) - 1):
+        for i, state in enumerate(self.state_history(t)):
             print 't =', t[i]
-            # set the interval
-            t_int = [t[i], t[i + 1]]
-            #print "self.t before int = ", self.t
-            #print "self.u before int = ", self.u
-            #print "self.x before int = ", self.x
-            #print "self.z before int = ", self.z
-            #print "self.y before int = ", self.y
-            # return the next state
-            x[i + 1] = odeint(self.f, x[i], t_int)[1, :]
-            # calculate the next input value
-            u[i + 1] = self.inputs(t[i + 1])
-            # calculate the outputs and store them
-            y[i + 1] = self.outputs(x[i + 1])
-            # update all the attributes
-            self.t = t[i + 1]
-            self.x = x[i + 1]
-            self.u = u[i + 1]
-            self.y = y[i + 1]
-            #print "self.t after int = ", self.t
-            #print "self.u after int = ", self.u
-            #print "self.x after int = ", self.x
-            #print "self.z after int = ", self.z
-            #print "self.y after int = ", self.y
+            x[i] = state
+            # calculate the input value
+            if out:
+                self.inputs(t[i], out=u[i])
+            else:
+                u[i] = self.inputs(t[i])
+
+        # calculate the outputs for the whole history
+        for i in range(0, len(t), self.batchSize):
+            j = i + self.batchSize
+            y[i:j] = self.outputs_batch(x[i:j], u[i:j])
+
+        # update all the attributes
+        self.u = u[-1]
+        self.y = y[-1]
 
         # make a dictionary of the integration and save it to file
         self.simResults = {'t':t,
@@ -284,6 +551,273 @@ class DynamicSystem(object):
                            'model':self.name,
                            'params':self.parameters}
 
+    def stream_simulation(self, path, chunkSize=1000):
+        """Simulates the system and writes the time histories to disk in
+        chunks as the integration proceeds.
+
+        Only one chunk of the time, state, input and output histories is held
+        in memory at a time, so the memory use does not grow with the length
+        of the simulation. Completed chunks can be read with a
+        `SimulationStore` while the simulation is still running.
+
+        Parameters
+        ----------
+        path : string
+            The directory in which to store the chunks. Any previous results
+            in this directory are removed.
+        chunkSize : integer, optional
+            The number of time steps in each chunk.
+
+        Returns
+        -------
+        store : SimulationStore
+            The store holding the results.
+
+        """
+        # make sure the constants are updated
+        self.constants()
+
+        # time vector
+        t = self.time_vector()
+
+        store = SimulationStore(path)
+        store.create({'model' : self.name,
+                      'params' : self.parameters,
+                      'stateNames' : self.stateNames,
+                      'inputNames' : self.inputNames,
+                      'outputNames' : self.outputNames,
+                      'chunkSize' : chunkSize,
+                      'length' : len(t)})
+
+        # the chunk buffers are reused for every chunk
+        x = np.zeros((chunkSize, len(self.x)))
+        u = np.zeros((chunkSize, len(self.u)))
+        y = np.zeros((chunkSize, len(self.y)))
+
+        out = _accepts_out(self.inputs)
+
+        j = 0
+        for i, state in enumerate(self.state_history(t)):
+            x[j] = state
+            if out:
+                self.inputs(t[i], out=u[j])
+            else:
+                u[j] = self.inputs(t[i])
+            j += 1
+            if j == chunkSize or i == len(t) - 1:
+                y[:j] = self.outputs_batch(x[:j], u[:j])
+                store.append(t=t[i + 1 - j:i + 1], x=x[:j], u=u[:j], y=y[:j])
+                self.u = u[j - 1]
+                self.y = y[j - 1]
+                j = 0
+
+        store.close()
+
+        return store
+
+    def time_vector(self):
+        """Returns the times at which the simulation results are reported.
+
+        Returns
+        -------
+        t : ndarray, shape(n,)
+            The times set by the integration options.
+
+        """
+        return np.linspace(self.intOpts['ti'],
+                           self.intOpts['tf'] - self.intOpts['ts'],
+                           (self.intOpts['tf'] - self.intOpts['ti']) / self.intOpts['ts'])
+
+    def state_history(self, t):
+        """Integrates the system from the initial conditions and yields the
+        state at each of the given times.
+
+        Parameters
+        ----------
+        t : ndarray, shape(n,)
+            The times at which to report the state.
+
+        Returns
+        -------
+        x : generator
+            Yields the state, ndarray shape(m,), at each time in `t`.
+
+        Notes
+        -----
+        The integrator is chosen by `integrator`. With 'rk4' the interval
+        between each pair of times is split into `fixedSteps` equal steps and
+        the state is integrated in place, so the same array is yielded at each
+        time and must be copied to be kept.
+
+        """
+        if self.integrator not in ('odeint', 'rk4'):
+            raise ValueError('{} is not a valid integrator.'.format(
+                self.integrator))
+
+        x = np.array(self.initialConditions, dtype=float)
+        self.t = t[0]
+        self.x = x
+        yield x
+
+        # the solver statistics are only gathered if profiling is enabled
+        profile = self.__dict__.get('_profile')
+
+        if self.integrator == 'rk4':
+            rk4 = RungeKutta4(self.f, len(x))
+            for i in range(len(t) - 1):
+                if profile is not None:
+                    start = time.time()
+                h = (t[i + 1] - t[i]) / self.fixedSteps
+                for k in range(self.fixedSteps):
+                    rk4.step(x, t[i] + k * h, h)
+                if profile is not None:
+                    solver = profile['solver']
+                    solver['time'] += time.time() - start
+                    solver['calls'] += 1
+                    solver['nst'] += self.fixedSteps
+                    solver['nfe'] += 4 * self.fixedSteps
+                self.t = t[i + 1]
+                yield x
+            return
+
+        from scipy.integrate import odeint
+
+        # reuse one array for the derivatives if the model allows it, odeint
+        # copies them out before the next call
+        if _accepts_out(self.f):
+            derivatives = np.zeros_like(x)
+            def rhs(x, t):
+                return self.f(x, t, out=derivatives)
+        else:
+            rhs = self.f
+
+        for i in range(len(t) - 1):
+            # return the next state
+            if profile is None:
+                x = odeint(rhs, x, [t[i], t[i + 1]])[1, :]
+            else:
+                start = time.time()
+                x, info = odeint(rhs, x, [t[i], t[i + 1]], full_output=True)
+                solver = profile['solver']
+                solver['time'] += time.time() - start
+                solver['calls'] += 1
+                for key in ('nst', 'nfe', 'nje'):
+                    solver[key] += int(info[key][-1])
+                x = x[1, :]
+            self.t = t[i + 1]
+            self.x = x
+            yield x
+
+    def enable_profiling(self, methods=None):
+        """Starts counting the calls to and timing the model's methods, along
+        with the statistics of the solver.
+
+        Parameters
+        ----------
+        methods : list, optional
+            The names of the methods to profile. The default is
+            `profiledMethods`.
+
+        Notes
+        -----
+        The methods are replaced by timing wrappers on this instance only, so
+        there is no overhead when profiling is disabled. Any input source
+        should be set before profiling is enabled. The counters are reset
+        each time profiling is enabled, see `profile_report`.
+
+        """
+        self.disable_profiling()
+        if methods is None:
+            methods = [m for m in self.profiledMethods if hasattr(self, m)]
+        self._profile = {'methods' : {},
+                         'solver' : {'calls' : 0,
+                                     'time' : 0.,
+                                     'nst' : 0,
+                                     'nfe' : 0,
+                                     'nje' : 0},
+                         'wrapped' : {}}
+        for name in methods:
+            self._profile['wrapped'][name] = self.__dict__.get(name)
+            self._profile['methods'][name] = {'calls' : 0, 'time' : 0.}
+            setattr(self, name, _profiled(getattr(self, name),
+                self._profile['methods'][name]))
+
+    def disable_profiling(self):
+        """Stops profiling and restores the original methods. The counters
+        are kept for `profile_report`."""
+        profile = self.__dict__.get('_profile')
+        if profile is None:
+            return
+        for name, original in profile['wrapped'].items():
+            if original is None:
+                self.__dict__.pop(name, None)
+            else:
+                setattr(self, name, original)
+        self._profileReport = self.profile_report()
+        del self._profile
+
+    def profile_report(self):
+        """Returns the counters gathered while profiling was enabled.
+
+        Returns
+        -------
+        report : dictionary
+            methods : dictionary
+                For each profiled method the number of calls, the total time
+                and the mean time per call in seconds. The times of methods
+                which call each other overlap.
+            solver : dictionary
+                The number of integration intervals and the total time spent
+                in the solver, with the number of steps (nst), derivative
+                evaluations (nfe) and Jacobian evaluations (nje) it reported.
+            overhead : float
+                The time spent in `simulate` outside of the solver, if it was
+                profiled.
+
+        """
+        profile = self.__dict__.get('_profile')
+        if profile is None:
+            return self.__dict__.get('_profileReport')
+        methods = {}
+        for name, counts in profile['methods'].items():
+            methods[name] = dict(counts)
+            methods[name]['mean'] = (counts['time'] / counts['calls'] if
+                    counts['calls'] else 0.)
+        report = {'methods' : methods,
+                  'solver' : dict(profile['solver'])}
+        if 'simulate' in methods:
+            report['overhead'] = (methods['simulate']['time'] -
+                    profile['solver']['time'])
+        return report
+
+    def stepper(self, dt, integrator=None):
+        """Returns an object which advances the system one interval at a
+        time, e.g. to co-simulate with an external controller.
+
+        Parameters
+        ----------
+        dt : float
+            The interval of each step.
+        integrator : string, optional
+            Either 'odeint', which steps a single LSODA solver that is only
+            restarted when the inputs change, or 'rk4' for `fixedSteps` fixed
+            steps per interval. The default is `integrator`.
+
+        Returns
+        -------
+        stepper : Stepper
+            Starts from the initial conditions at the initial time.
+
+        Examples
+        --------
+        >>> stepper = sys.stepper(0.01)
+        >>> for i in range(100):
+        ...     x = stepper.step(controller(stepper.outputs()))
+        >>> stepper.close()
+
+        """
+        return Stepper(self, dt, integrator=integrator)
+
     def save_sim(self):
         '''
         Save simulation to file
@@ -293,15 +827,27 @@ class DynamicSystem(object):
             pass
         else:
             os.system('mkdir ' + self.directory)
+        import pickle
         pickle.dump(self.simResults, open(self.directory + self.filename + '.p', 'w'))
 
-    def plot(self):
+    def plot(self, decimate=True):
         '''
         Makes a plot of the simulation
 
+        Parameters
+        ----------
+        decimate : boolean, optional
+            If true, long time histories are reduced to the minimum and
+            maximum of each output in each pixel of the figure's width, which
+            looks the same but renders in constant time.
+
         '''
+        plt = _pyplot()
         fig = plt.figure()
-        plt.plot(self.simResults['t'], self.simResults['y'])
+        t, y = self.simResults['t'], self.simResults['y']
+        if decimate is True:
+            t, y = envelope(t, y, _pixel_width(fig))
+        plt.plot(t, y)
         plt.legend(self.outputNames)
         plt.xlabel('Time [sec]')
         return fig
@@ -310,6 +856,13 @@ class LinearDynamicSystem(DynamicSystem):
 
     name = "LinearDynamicSystem"
 
+    # the maximum number of linearizations kept in the cache, zero turns the
+    # cache off
+    linearCacheSize = 128
+
+    # the number of root loci kept for reuse by plot_root_locus
+    rootLociCacheSize = 8
+
     def f(self, x, t):
         '''Returns the derivative of the states.'''
 
@@ -327,52 +880,290 @@ class LinearDynamicSystem(DynamicSystem):
 
         return y
 
-    def linear(self, equilibriumPoint):
+    def outputs_batch(self, X, U=None):
+        '''Returns the outputs for a whole history of states. Like `outputs`
+        the feedforward is not included, so the inputs are not used.'''
+
+        return np.dot(X, self.C.T)
+
+    def f_batch(self, X, U=None):
+        '''Returns the derivatives of many state vectors at once.'''
+
+        if U is None:
+            U = np.zeros((X.shape[0], len(self.inputNames)))
+
+        return np.dot(X, self.A.T) + np.dot(U, np.reshape(self.B,
+            (len(self.stateNames), -1)).T)
+
+    def linear(self, equilibriumPoint, method='central', step=None):
         """Calculates the state, input, output and feedforward  matrices for the
         system linearized about the provided equilibrium point.
 
+        The matrices are found by numerical differentiation of the nonlinear
+        equations of motion and outputs with the inputs set to zero. All of
+        the states and inputs are perturbed at once through `f_batch` and
+        `outputs_batch`. Generated models which have the linear equations from
+        Autolev override this.
+
         Parameters
         ----------
         equilibriumPoint : ndarray, shape(n,)
             The point at which to linearize the system about. The order of the
             values corresponds to the system states.
+        method : string, optional
+            Either 'central' for central differences or 'complex' for the
+            complex step derivative. The complex step is exact to machine
+            precision but needs a model with vectorized `f_batch` and
+            `outputs_batch` and equations that are analytic.
+        step : float, optional
+            The perturbation. The default is scaled to each variable for
+            central differences and 1e-20 for the complex step.
 
         """
 
+        # make sure the constants are up to date
+        self.update_constants()
+
         self.equilibriumPoint = equilibriumPoint
+        if self.linear_from_cache(equilibriumPoint, method=method, step=step):
+            return
+
+        x = np.asarray(equilibriumPoint, dtype=float)[np.newaxis]
+        u = np.zeros((1, len(self.inputNames)))
+        self.A, self.B, self.C, self.D = [M[0] for M in self._jacobians(x, u,
+            method=method, step=step)]
+
+        self.linear_to_cache(equilibriumPoint, method=method, step=step)
+
+    def _jacobians(self, X, U, method='central', step=None):
+        """Returns the stacked A, B, C and D matrices of the nonlinear system
+        at each row of the states and inputs by numerical differentiation, see
+        `linear`. All of the perturbations of all of the rows are evaluated
+        in one call of the batch methods."""
+
+        k, n = X.shape
+        m = U.shape[1]
+        V = np.hstack((X, U))
+        identity = np.eye(n + m)
+
+        if method == 'complex':
+            if step is None:
+                step = 1e-20
+            # row j of each block perturbs the jth state or input
+            W = V[:, np.newaxis, :] + 1j * step * identity
+            F, Y = self._nonlinear_batch(*np.hsplit(W.reshape(-1, n + m),
+                [n]))
+            dF = F.imag.reshape(k, n + m, -1) / step
+            dY = Y.imag.reshape(k, n + m, -1) / step
+        elif method == 'central':
+            if step is None:
+                step = np.finfo(float).eps**(1. / 3.) * np.maximum(1.,
+                        np.abs(V))
+            else:
+                step = step * np.ones((k, n + m))
+            W = step[:, :, np.newaxis] * identity
+            W = np.concatenate((V[:, np.newaxis, :] + W,
+                V[:, np.newaxis, :] - W), axis=1)
+            F, Y = self._nonlinear_batch(*np.hsplit(W.reshape(-1, n + m),
+                [n]))
+            F = F.reshape(k, 2 * (n + m), -1)
+            Y = Y.reshape(k, 2 * (n + m), -1)
+            dF = (F[:, :n + m] - F[:, n + m:]) / (2. * step[:, :, np.newaxis])
+            dY = (Y[:, :n + m] - Y[:, n + m:]) / (2. * step[:, :, np.newaxis])
+        else:
+            raise ValueError('{} is not a valid method.'.format(method))
+
+        # row j of dF and dY is the derivative with respect to the jth state
+        # or input
+        A = dF[:, :n].transpose(0, 2, 1).copy()
+        B = dF[:, n:].transpose(0, 2, 1).copy()
+        C = dY[:, :n].transpose(0, 2, 1).copy()
+        D = dY[:, n:].transpose(0, 2, 1).copy()
+
+        return A, B, C, D
+
+    def linear_trajectory(self, X, U=None, processes=None):
+        """Returns the linear system matrices at each sample of a trajectory,
+        e.g. `simResults['x']` and `simResults['u']`.
+
+        Parameters
+        ----------
+        X : ndarray, shape(k, n)
+            The states, one sample per row.
+        U : ndarray, shape(k, m), optional
+            The inputs, one sample per row, the default is zero. The
+            linearizations from Autolev are always about zero inputs, so these
+            are only used by the numerical linearization.
+        processes : integer, optional
+            If greater than one, the samples are split into chunks which are
+            linearized in a pool of this many worker processes.
+
+        Returns
+        -------
+        A : ndarray, shape(k, n, n)
+        B : ndarray, shape(k, n, m)
+        C : ndarray, shape(k, p, n)
+        D : ndarray, shape(k, p, m)
+            The stacked state, input, output and feedforward matrices.
+
+        Notes
+        -----
+        Models without linear equations from Autolev are differentiated
+        numerically `batchSize` samples at a time, with all of the
+        perturbations of a chunk evaluated in a single call of the batch
+        methods. The others are linearized with `linear_batch`.
+
+        """
+        X = np.asarray(X, dtype=float)
+        if U is None:
+            U = np.zeros((X.shape[0], len(self.inputNames)))
+        U = np.asarray(U, dtype=float)
+
+        if (type(self).linear.__func__ is not
+                LinearDynamicSystem.linear.__func__):
+            points = [({}, x) for x in X]
+            return self.linear_batch(points, processes=processes)
+
+        size = self.batchSize
+        if processes is not None and processes > 1:
+            size = min(size, int(np.ceil(len(X) / float(processes))))
+        chunks = [(X[i:i + size], U[i:i + size]) for i in range(0, len(X),
+            size)]
+
+        if processes is not None and processes > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_trajectory_chunk, [(self.__class__,
+                    dict(self.parameters), Xc, Uc) for Xc, Uc in chunks])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            self.update_constants()
+            results = [self._jacobians(Xc, Uc) for Xc, Uc in chunks]
+
+        return tuple(np.concatenate([r[i] for r in results]) for i in
+                range(4))
+
+    def _nonlinear_batch(self, X, U):
+        """Returns the state derivatives and outputs of the nonlinear system
+        for each row of the states and inputs."""
+
+        nonlinear = super(LinearDynamicSystem, self)
+
+        if nonlinear.f_batch.__func__ is not DynamicSystem.f_batch.__func__:
+            return nonlinear.f_batch(X, U), nonlinear.outputs_batch(X, U)
+
+        if np.iscomplexobj(X) or np.iscomplexobj(U):
+            raise ValueError('The complex step needs a model with f_batch.')
+
+        F = np.zeros((X.shape[0], len(self.stateNames)))
+        Y = np.zeros((X.shape[0], len(self.outputNames)))
+        inputs = self.__dict__.get('inputs')
+        try:
+            for i, x in enumerate(X):
+                self.inputs = HeldInputs(U[i])
+                F[i] = nonlinear.f(x, self.t)
+                Y[i] = nonlinear.outputs(x)
+        finally:
+            self.set_input_source(inputs)
+
+        return F, Y
+
+    def _linear_key(self, x, method, step):
+        """Returns a hash of the parameters, the equilibrium point and the
+        differentiation options."""
+        key = hashlib.sha1(repr((sorted(self.parameters.items()), method,
+            step)).encode())
+        key.update(np.asarray(x, dtype=float).tobytes())
+        return key.hexdigest()
+
+    def linear_from_cache(self, x, method='central', step=None):
+        """Sets the linear system matrices from the cache if the system has
+        already been linearized about this point with the current parameters
+        and the same differentiation options.
+
+        Parameters
+        ----------
+        x : ndarray, shape(n,)
+            The equilibrium point.
+        method : string, optional
+            The differentiation method, see `linear`.
+        step : float, optional
+            The perturbation, see `linear`.
+
+        Returns
+        -------
+        hit : boolean
+            True if the matrices were found in the cache.
+
+        """
+        if self.linearCacheSize <= 0:
+            return False
+
+        if '_linearCache' not in self.__dict__:
+            self._linearCache = collections.OrderedDict()
+            self._linearCacheCounts = {'hits' : 0, 'misses' : 0}
+
+        key = self._linear_key(x, method, step)
+        try:
+            matrices = self._linearCache.pop(key)
+        except KeyError:
+            self._linearCacheCounts['misses'] += 1
+            return False
+
+        # move it to the most recently used end
+        self._linearCache[key] = matrices
+        self._linearCacheCounts['hits'] += 1
+        self.A, self.B, self.C, self.D = [m.copy() for m in matrices]
+
+        return True
+
+    def linear_to_cache(self, x, method='central', step=None):
+        """Stores the current linear system matrices in the cache, dropping
+        the least recently used entry if it is full.
+
+        Parameters
+        ----------
+        x : ndarray, shape(n,)
+            The equilibrium point the matrices were calculated at.
+        method : string, optional
+            The differentiation method, see `linear`.
+        step : float, optional
+            The perturbation, see `linear`.
 
-        # sets the zees for the equilbrium points
-        nonlin = DynamicSystem()
-        nonlin.f(self.equilibriumPoint, 0.)
-
-        # defines the A, B, C, D matrices
-        self.A = np.zeros((2,2))
-        self.B = np.zeros(2)
-        self.C = np.zeros((5,2))
-        self.D = np.zeros(5)
-        self.A[0,0] = 0
-        self.A[0,1] = 1
-        self.A[1,0] = -0.5*self.z[13]
-        self.A[1,1] = 0
-        self.B[0] = 0
-        self.B[1] = self.z[3]/self.z[11]
-        self.C[0,0] = 1
-        self.C[0,1] = 0
-        self.C[1,0] = 0
-        self.C[1,1] = 1
-        self.C[2,0] = 0
-        self.C[2,1] = 0.25*self.z[14]
-        self.C[3,0] = 0.5*self.z[16]
-        self.C[3,1] = 0
-        self.C[4,0] = 2
-        self.C[4,1] = 0
-        self.D[0] = 0
-        self.D[1] = 0
-        self.D[2] = 0
-        self.D[3] = 0
-        self.D[4] = 0
-
-    def root_locus(self, var, start, stop, num=50, sort=False):
+        """
+        if self.linearCacheSize <= 0:
+            return
+
+        if '_linearCache' not in self.__dict__:
+            self._linearCache = collections.OrderedDict()
+            self._linearCacheCounts = {'hits' : 0, 'misses' : 0}
+
+        self._linearCache[self._linear_key(x, method, step)] = tuple(
+                np.array(m) for m in (self.A, self.B, self.C, self.D))
+        while len(self._linearCache) > self.linearCacheSize:
+            self._linearCache.popitem(last=False)
+
+    def linear_cache_info(self):
+        """Returns a dictionary with the number of cache hits and misses, the
+        number of cached linearizations and the maximum size of the cache."""
+        counts = self.__dict__.get('_linearCacheCounts', {'hits' : 0,
+            'misses' : 0})
+        return {'hits' : counts['hits'],
+                'misses' : counts['misses'],
+                'size' : len(self.__dict__.get('_linearCache', {})),
+                'maxSize' : self.linearCacheSize}
+
+    def clear_linear_cache(self):
+        """Empties the linearization cache and resets the counters."""
+        self.__dict__.pop('_linearCache', None)
+        self.__dict__.pop('_linearCacheCounts', None)
+
+    def root_locus(self, var, start, stop, num=50, sort=False,
+            processes=None, adaptive=False, tol=0.05, xtol=None,
+            maxNum=1000, zeroTol=1e-8):
         """Returns the eigenvalues and eigenvectors as a function of a single
         parameter.
 
@@ -388,6 +1179,27 @@ class LinearDynamicSystem(DynamicSystem):
             The number of steps, default is 50.
         sort : boolean, optional
             Default is false, if true the eigenvalues are sorted.
+        processes : integer, optional
+            The number of worker processes used to linearize the system, see
+            `linear_batch`.
+        adaptive : boolean, optional
+            If true, the `num` evenly spaced values are refined where the
+            eigenvalues change quickly and the values at which the system
+            becomes stable or unstable are located by bisection.
+        tol : float, optional
+            The largest change of any eigenvalue between neighbouring values,
+            relative to one plus the largest eigenvalue magnitude, allowed by
+            the adaptive refinement.
+        xtol : float, optional
+            The adaptive refinement does not split intervals narrower than
+            this and the stability crossings are located to within it. The
+            default is a millionth of the range.
+        maxNum : integer, optional
+            The adaptive refinement stops once there are this many values.
+        zeroTol : float, optional
+            Eigenvalues with a magnitude below this, e.g. those of ignorable
+            coordinates, are not considered when the adaptive refinement
+            decides whether the system is stable.
 
         Returns
         -------
@@ -397,38 +1209,393 @@ class LinearDynamicSystem(DynamicSystem):
             The values at which the model was linea
 
         """
-        eValues = np.zeros((num, len(self.stateNames)), dtype=complex)
-        eVectors = np.zeros((num, len(self.stateNames), len(self.stateNames)),
-                dtype=complex)
-        values = np.linspace(start, stop, num=num)
-
-        if var in self.parameters.keys():
-            original = self.parameters[var]
-            for i, val in enumerate(values):
-                self.parameters[var] = val
-                self.linear(self.equilibriumPoint)
-                eValues[i], eVectors[i] = self.eig()
-            # set the model back to the default
-            self.parameters[var] = original
-            self.linear(self.equilibriumPoint)
-        elif var in self.stateNames:
-            index = self.stateNames.index(var)
-            original = self.equilibriumPoint[index]
-            for i, val in enumerate(values):
-                self.equilibriumPoint[index] = val
-                self.linear(self.equilibriumPoint)
-                eValues[i], eVectors[i] = self.eig()
-            # set the model back to the default
-            self.equilibriumPoint[index] = original
-            self.linear(self.equilibriumPoint)
+        if adaptive is True:
+            values, A = self._adaptive_locus(var, start, stop, num, tol,
+                    xtol, maxNum, processes, zeroTol)
         else:
-            raise ValueError('{} is not a valid parameter.'.format(var))
+            values = np.linspace(start, stop, num=num)
+            points = self.sweep_points((var,), values[:, np.newaxis])
+            A = self.linear_batch(points, processes=processes)[0]
+
+        # the eigenvalues of all the state matrices are found at once
+        eValues, eVectors = eig(A)
 
         if sort is True:
             eValues, eVectors = self.sort_modes(eValues, eVectors)
 
         return eValues, eVectors, values
 
+    def _adaptive_locus(self, var, start, stop, num, tol, xtol, maxNum,
+            processes, zeroTol):
+        """Returns the values and state matrices of an adaptive root locus,
+        see `root_locus`."""
+
+        if xtol is None:
+            xtol = abs(stop - start) * 1e-6
+
+        def linearize(values):
+            points = self.sweep_points((var,), np.reshape(values, (-1, 1)))
+            A = self.linear_batch(points, processes=processes)[0]
+            return A, np.linalg.eigvals(A)
+
+        from scipy.optimize import linear_sum_assignment
+
+        values = np.linspace(start, stop, num=num)
+        A, evals = linearize(values)
+
+        # split the intervals where the eigenvalues move too far, all of the
+        # new values of a pass are linearized together
+        while len(values) < maxNum:
+            change = np.zeros(len(values) - 1)
+            for i in range(len(values) - 1):
+                distance = np.abs(evals[i][:, np.newaxis] -
+                        evals[i + 1][np.newaxis, :])
+                rows, cols = linear_sum_assignment(distance)
+                scale = 1. + max(np.abs(evals[i]).max(),
+                        np.abs(evals[i + 1]).max())
+                change[i] = distance[rows, cols].max() / scale
+            split = np.nonzero((change > tol) &
+                    (np.abs(np.diff(values)) > 2. * xtol))[0]
+            split = split[:maxNum - len(values)]
+            if len(split) == 0:
+                break
+            middle = (values[split] + values[split + 1]) / 2.
+            newA, newEvals = linearize(middle)
+            values = np.insert(values, split + 1, middle)
+            A = np.insert(A, split + 1, newA, axis=0)
+            evals = np.insert(evals, split + 1, newEvals, axis=0)
+
+        # bisect the intervals where the system becomes stable or unstable,
+        # all of the crossings are bisected together
+        stable = _max_real(evals, zeroTol) < 0.
+        crossing = np.nonzero(stable[:-1] != stable[1:])[0]
+        lower = values[crossing]
+        upper = values[crossing + 1]
+        lowerStable = stable[crossing]
+        lowerA = A[crossing]
+        upperA = A[crossing + 1]
+        while len(crossing) > 0 and np.abs(upper - lower).max() > xtol:
+            middle = (lower + upper) / 2.
+            middleA, middleEvals = linearize(middle)
+            same = (_max_real(middleEvals, zeroTol) < 0.) == lowerStable
+            lower = np.where(same, middle, lower)
+            upper = np.where(same, upper, middle)
+            lowerA[same] = middleA[same]
+            upperA[~same] = middleA[~same]
+
+        # keep the brackets around each crossing
+        if len(crossing) > 0:
+            values = np.hstack((values, lower, upper))
+            A = np.concatenate((A, lowerA, upperA))
+            values, order = np.unique(values, return_index=True)
+            if start > stop:
+                order = order[::-1]
+                values = values[::-1]
+            A = A[order]
+
+        return values, A
+
+    def lqr_schedule(self, var, values, Q, R, states=None, inputs=None,
+            path=None, processes=None, tol=1e-10, maxIter=20):
+        """Returns a table of linear quadratic regulator gains designed at
+        each of a series of values of a parameter, e.g. the speed.
+
+        Parameters
+        ----------
+        var : string
+            The parameter or equilibrium point state to schedule on.
+        values : array_like, shape(k,)
+            The values to design the gains at, ordered so that neighbouring
+            values are close.
+        Q : ndarray, shape(n, n)
+            The state weighting matrix.
+        R : ndarray, shape(m, m)
+            The input weighting matrix.
+        states : list, optional
+            The names of the states to design with, the default is all of
+            them.
+        inputs : list, optional
+            The names of the inputs to design with, the default is all of
+            them.
+        path : string, optional
+            A directory to cache the schedule in. A schedule is reused if the
+            model, its parameters and equilibrium point, and all of the
+            arguments but `processes` match.
+        processes : integer, optional
+            The number of worker processes used to linearize the system, see
+            `linear_batch`.
+        tol : float, optional
+            The relative change of the Riccati solution at which the warm
+            started iterations stop.
+        maxIter : integer, optional
+            The most warm started iterations before falling back to a direct
+            solution.
+
+        Returns
+        -------
+        schedule : dictionary
+            values : ndarray, shape(k,)
+                The values of `var`.
+            K : ndarray, shape(k, m, n)
+                The gains, u = -K x.
+            P : ndarray, shape(k, n, n)
+                The solutions of the Riccati equation.
+            eigenvalues : ndarray, shape(k, n)
+                The closed loop eigenvalues.
+
+        Notes
+        -----
+        Each Riccati equation is solved by Newton-Kleinman iterations started
+        from the gain of the previous value, which take a few Lyapunov
+        solutions when the values are close together. A direct solution is
+        used for the first value and whenever the previous gain does not
+        stabilize the system or the iterations do not converge.
+
+        """
+        values = np.asarray(values, dtype=float)
+        Q = np.asarray(Q, dtype=float)
+        R = np.asarray(R, dtype=float)
+        if states is None:
+            states = self.stateNames
+        if inputs is None:
+            inputs = self.inputNames
+        stateIndices = [self.stateNames.index(x) for x in states]
+        inputIndices = [self.inputNames.index(u) for u in inputs]
+
+        import pickle
+        from scipy.linalg import solve_continuous_are
+
+        if path is not None:
+            key = hashlib.sha1(self._model_hash().encode())
+            key.update(repr((var, list(states), list(inputs),
+                sorted(self.parameters.items()), tol, maxIter)).encode())
+            for array in (self.equilibriumPoint, values, Q, R):
+                key.update(np.asarray(array, dtype=float).tobytes())
+            cacheFile = os.path.join(path, 'lqr' + key.hexdigest() + '.p')
+            if os.path.isfile(cacheFile):
+                with open(cacheFile, 'rb') as f:
+                    return pickle.load(f)
+
+        points = self.sweep_points((var,), values[:, np.newaxis])
+        A, B = self.linear_batch(points, processes=processes)[:2]
+        A = A[:, stateIndices][:, :, stateIndices]
+        B = np.reshape(B, (len(values), len(self.stateNames),
+            -1))[:, stateIndices][:, :, inputIndices]
+
+        n = len(stateIndices)
+        K = np.zeros((len(values), len(inputIndices), n))
+        P = np.zeros((len(values), n, n))
+        eigenvalues = np.zeros((len(values), n), dtype=complex)
+        Rinv = np.linalg.inv(R)
+        for i in range(len(values)):
+            Pi = None
+            if i > 0:
+                Pi = _newton_kleinman(A[i], B[i], Q, R, Rinv, K[i - 1], tol,
+                        maxIter)
+            if Pi is None:
+                Pi = solve_continuous_are(A[i], B[i], Q, R)
+            P[i] = Pi
+            K[i] = np.dot(Rinv, np.dot(B[i].T, Pi))
+            eigenvalues[i] = np.linalg.eigvals(A[i] - np.dot(B[i], K[i]))
+
+        schedule = {'values' : values,
+                    'K' : K,
+                    'P' : P,
+                    'eigenvalues' : eigenvalues}
+
+        if path is not None:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            # write to a temporary file first so a reader never sees a
+            # partial schedule
+            temporary = cacheFile + '.tmp'
+            with open(temporary, 'wb') as f:
+                pickle.dump(schedule, f, protocol=2)
+            os.rename(temporary, cacheFile)
+
+        return schedule
+
+    def _model_hash(self):
+        """Returns a hash of the model's name and the source of its module,
+        so that cached results are not reused after the model is
+        regenerated. The source is found through linecache, so models
+        compiled in memory by altk.modelcompiler are covered too."""
+        key = hashlib.sha1(self.name.encode())
+        try:
+            source = inspect.getsource(sys.modules[self.__module__])
+        except (IOError, TypeError, KeyError):
+            pass
+        else:
+            if not isinstance(source, bytes):
+                source = source.encode('utf-8')
+            key.update(source)
+        return key.hexdigest()
+
+    def sweep(self, grid, processes=None, zeroTol=1e-8):
+        """Returns the eigenvalues and the stability over a grid of parameter
+        values, e.g. the trail and the speed.
+
+        Parameters
+        ----------
+        grid : sequence
+            A sequence of (name, values) pairs, one for each dimension of the
+            grid, where name is a parameter or an equilibrium point state and
+            values is a 1D array.
+        processes : integer, optional
+            The number of worker processes used to linearize the system, see
+            `linear_batch`.
+        zeroTol : float, optional
+            Eigenvalues with a magnitude below this, e.g. those of ignorable
+            coordinates, are left out of the stability margin.
+
+        Returns
+        -------
+        sweep : dictionary
+            names : list
+                The names of the grid dimensions.
+            values : list
+                The values along each dimension.
+            eigenvalues : ndarray, shape(k1, k2, ..., n)
+                The eigenvalues at each point of the grid.
+            maxReal : ndarray, shape(k1, k2, ...)
+                The largest real part of the eigenvalues which are not zero,
+                the negative of the stability margin.
+            stable : ndarray, shape(k1, k2, ...)
+                True where all of the eigenvalues which are not zero have
+                negative real parts.
+            crossings : list
+                For each dimension, an array with the shape of the grid less
+                one along that dimension which holds the value at which
+                `maxReal` crosses zero between neighbouring points, found by
+                linear interpolation, and NaN where it does not cross.
+
+        Notes
+        -----
+        The points are linearized and their eigenvalues found `batchSize` at a
+        time, so the memory used does not grow with the size of the grid.
+
+        """
+        names = [name for name, values in grid]
+        values = [np.asarray(values, dtype=float) for name, values in grid]
+        shape = tuple(len(v) for v in values)
+        rows = np.column_stack([g.ravel() for g in np.meshgrid(*values,
+            indexing='ij')])
+
+        eigenvalues = np.zeros((len(rows), len(self.stateNames)),
+                dtype=complex)
+        for i in range(0, len(rows), self.batchSize):
+            j = i + self.batchSize
+            points = self.sweep_points(names, rows[i:j])
+            A = self.linear_batch(points, processes=processes)[0]
+            eigenvalues[i:j] = np.linalg.eigvals(A)
+        eigenvalues = eigenvalues.reshape(shape + (len(self.stateNames),))
+        maxReal = _max_real(eigenvalues, zeroTol)
+
+        crossings = []
+        for axis, v in enumerate(values):
+            first = [slice(None)] * len(shape)
+            last = [slice(None)] * len(shape)
+            first[axis] = slice(None, -1)
+            last[axis] = slice(1, None)
+            m1 = maxReal[tuple(first)]
+            m2 = maxReal[tuple(last)]
+            # the values along this dimension broadcast against the grid
+            vShape = [1] * len(shape)
+            vShape[axis] = len(v) - 1
+            v1 = v[:-1].reshape(vShape)
+            v2 = v[1:].reshape(vShape)
+            crosses = (m1 < 0.) != (m2 < 0.)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                value = v1 - m1 * (v2 - v1) / (m2 - m1)
+            crossings.append(np.where(crosses, value, np.nan))
+
+        return {'names' : names,
+                'values' : values,
+                'eigenvalues' : eigenvalues,
+                'maxReal' : maxReal,
+                'stable' : maxReal < 0.,
+                'crossings' : crossings}
+
+    def sweep_points(self, names, rows):
+        """Returns the points needed to linearize the system over a set of
+        parameter and equilibrium point values.
+
+        Parameters
+        ----------
+        names : sequence of strings
+            The parameters or equilibrium point states (or both) to vary.
+        rows : ndarray, shape(k, len(names))
+            Each row holds one value for each of the names.
+
+        Returns
+        -------
+        points : list
+            A list of (parameters, equilibriumPoint) tuples suitable for
+            `linear_batch`.
+
+        """
+        for name in names:
+            if name not in self.parameters and name not in self.stateNames:
+                raise ValueError('{} is not a valid parameter.'.format(name))
+
+        points = []
+        for row in rows:
+            par = {}
+            equilibriumPoint = np.array(self.equilibriumPoint, dtype=float)
+            for name, val in zip(names, row):
+                if name in self.parameters:
+                    par[name] = val
+                else:
+                    equilibriumPoint[self.stateNames.index(name)] = val
+            points.append((par, equilibriumPoint))
+
+        return points
+
+    def linear_batch(self, points, processes=None):
+        """Returns the linear system matrices for a series of parameter sets
+        and equilibrium points.
+
+        Parameters
+        ----------
+        points : list
+            A list of (parameters, equilibriumPoint) tuples. The parameters
+            dictionary only needs to contain the parameters which differ from
+            the current ones.
+        processes : integer, optional
+            If greater than one, the points are split into chunks which are
+            linearized in a pool of this many worker processes. Otherwise they
+            are linearized in this process.
+
+        Returns
+        -------
+        A : ndarray, shape(k, n, n)
+        B : ndarray, shape(k, n, m)
+        C : ndarray, shape(k, p, n)
+        D : ndarray, shape(k, p, m)
+            The stacked state, input, output and feedforward matrices.
+
+        Notes
+        -----
+        The system is linearized about its current equilibrium point again
+        afterwards, so `A`, `B`, `C` and `D` are left unchanged.
+
+        """
+        if processes is not None and processes > 1:
+            size = int(np.ceil(len(points) / float(processes)))
+            chunks = [(self.__class__, dict(self.parameters),
+                points[i:i + size]) for i in range(0, len(points), size)]
+            import multiprocessing
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_linear_chunk, chunks)
+            finally:
+                pool.close()
+                pool.join()
+            return tuple(np.concatenate([r[i] for r in results]) for i in
+                    range(4))
+        else:
+            return _linear_chunk((self, None, points))
+
     def eig(self, essential=None):
         """Returns the eigenvalues and eigenvectors of the system.
 
@@ -472,6 +1639,7 @@ class LinearDynamicSystem(DynamicSystem):
         if states is None:
             states = self.stateNames
 
+        plt = _pyplot()
         w, v = self.remove_eig_pairs()
         figs = []
         lw = range(1, len(states) + 1)
@@ -495,7 +1663,7 @@ class LinearDynamicSystem(DynamicSystem):
 
         return figs
 
-    def sort_modes(self, evals, evecs):
+    def sort_modes(self, evals, evecs, vectorWeight=0.0):
         """Sort a series of eigenvalues and eigenvectors into modes.
 
         Parameters
@@ -504,67 +1672,72 @@ class LinearDynamicSystem(DynamicSystem):
             eigenvalues
         evecs : ndarray, shape (n, m, m)
             eigenvectors
+        vectorWeight : float, optional
+            If non-zero, the eigenvectors are also used to track the modes.
+            One minus the magnitude of the cosine of the angle between two
+            eigenvectors is multiplied by this weight and added to the
+            distance between their eigenvalues.
+
+        Returns
+        -------
+        evals : ndarray, shape (n, k)
+            The non-zero eigenvalues where each column is a mode.
+        evecs : ndarray, shape (n, m, k)
+            The eigenvectors corresponding to the sorted eigenvalues.
+
+        Notes
+        -----
+        The zero eigenvalues are removed first and the number of non-zero
+        eigenvalues is taken as the most common count in the series. The
+        eigenvalues at each step are then matched to those at the previous
+        step by solving the assignment problem which minimizes the total
+        distance between the matched eigenvalues.
 
         """
-        # first take a random sampling of the eigenvalues to determine how many
-        # non-zero eigenvalues are in the system
-        if len(evals) < 20:
-            size = len(evals)
-        else:
-            size = 20
-        randEvals = np.abs(evals[np.random.randint(0, len(evals), size=size)])
-        # now count how many non-zero entries are in this sample, this
-        # threshold isn't alwasy perfect
-        eigCounts = np.array([np.count_nonzero((e - 0.0) > 1e-20) for e in randEvals])
-        numNonzero = int(np.round(eigCounts.mean()))
-        # now let's go through and build a reduced set of eigenvalues and
-        # eigenvectors
-        reducedEvals = np.zeros((evals.shape[0], numNonzero),
-                dtype=evals.dtype)
-        reducedEvecs = np.zeros((evecs.shape[0], evecs.shape[1], numNonzero),
-                dtype=evecs.dtype)
-        for i, eigSet in enumerate(evals):
-            # the length of the indices should be equal to the number of
-            # non-zero entries, but it is possible for it to be less due to the
-            # fact that the eigenvalue loci can pass through the origin
-            nonZeroInd = np.abs(eigSet) > 1e-14
-
-            reducedEigSet = eigSet[nonZeroInd]
-            reducedEvals[i, :len(reducedEigSet)] = reducedEigSet
-
-            reducedEvecSet = evecs[i][:, nonZeroInd]
-            reducedEvecs[i, :, :reducedEvecSet.shape[1]] = reducedEvecSet
-
-        # now it is only needed to sort the eigenvalues of the reduced set
+        from scipy.optimize import linear_sum_assignment
+
+        # count the non-zero eigenvalues at every step and keep the most
+        # common number of them
+        nonZero = np.abs(evals) > 1e-14
+        numNonzero = np.bincount(nonZero.sum(axis=1)).argmax()
+
+        # move the non-zero eigenvalues to the front of each set, keeping
+        # their order, and drop the rest. The loci can pass through the origin
+        # so some sets may have to keep a zero eigenvalue.
+        order = np.argsort(~nonZero, axis=1, kind='mergesort')[:, :numNonzero]
+        steps = np.arange(evals.shape[0])[:, np.newaxis]
+        reducedEvals = evals[steps, order]
+        reducedEvecs = evecs[steps[:, :, np.newaxis],
+                np.arange(evecs.shape[1])[np.newaxis, :, np.newaxis],
+                order[:, np.newaxis, :]]
+
+        if vectorWeight != 0.0:
+            norms = np.sqrt((np.abs(reducedEvecs)**2).sum(axis=1))
+            norms[norms == 0.0] = 1.0
+            unitEvecs = reducedEvecs / norms[:, np.newaxis, :]
 
         evalsorg = np.zeros_like(reducedEvals)
         evecsorg = np.zeros_like(reducedEvecs)
         # set the first row to be the same
         evalsorg[0] = reducedEvals[0]
         evecsorg[0] = reducedEvecs[0]
-        # for each set of eigenvalues
-        for i, evalSet in enumerate(reducedEvals):
-            if i == reducedEvals.shape[0] - 1:
-                break
-            # for each current eigenvalue
-            used = []
-            for j, e in enumerate(evalSet):
-                x, y = np.real(evalsorg[i, j]), np.imag(evalsorg[i, j])
-                # for each eigenvalue at the next speed
-                dist = np.zeros(reducedEvals.shape[1])
-                for k, eignext in enumerate(reducedEvals[i + 1]):
-                    xn, yn = np.real(eignext), np.imag(eignext)
-                    # distance between points in the real/imag plane
-                    dist[k] = np.abs(((xn - x)**2 + (yn - y)**2)**0.5)
-                if np.argmin(dist) in used:
-                    # set the already used indice higher
-                    dist[np.argmin(dist)] = np.max(dist) + 1.
-                else:
-                    pass
-                evalsorg[i + 1, j] = reducedEvals[i + 1, np.argmin(dist)]
-                evecsorg[i + 1, :, j] = reducedEvecs[i + 1, :, np.argmin(dist)]
-                # keep track of the indices we've used
-                used.append(np.argmin(dist))
+        if vectorWeight != 0.0:
+            previousVecs = unitEvecs[0]
+        for i in range(1, reducedEvals.shape[0]):
+            # distance between each previous and next eigenvalue in the
+            # real/imag plane
+            cost = np.abs(evalsorg[i - 1][:, np.newaxis] -
+                    reducedEvals[i][np.newaxis, :])
+            if vectorWeight != 0.0:
+                overlap = np.abs(np.dot(previousVecs.conj().T, unitEvecs[i]))
+                cost += vectorWeight * (1.0 - overlap)
+            rows, cols = linear_sum_assignment(cost)
+            match = cols[np.argsort(rows)]
+            evalsorg[i] = reducedEvals[i, match]
+            evecsorg[i] = reducedEvecs[i][:, match]
+            if vectorWeight != 0.0:
+                previousVecs = unitEvecs[i][:, match]
+
         return evalsorg, evecsorg
 
     def remove_eig_pairs(self):
@@ -593,9 +1766,25 @@ class LinearDynamicSystem(DynamicSystem):
                 indices.append(i)
         return w[indices], v[:, indices]
 
+    def _cached_root_locus(self, parameter, start, stop, num):
+        """Returns the unsorted root locus, reusing the result of a previous
+        call with the same arguments, parameters and equilibrium point."""
+        if '_rootLoci' not in self.__dict__:
+            self._rootLoci = collections.OrderedDict()
+        key = (parameter, start, stop, num,
+                self._linear_key(self.equilibriumPoint, 'central', None))
+        try:
+            loci = self._rootLoci.pop(key)
+        except KeyError:
+            loci = self.root_locus(parameter, start, stop, num=num)
+        self._rootLoci[key] = loci
+        while len(self._rootLoci) > self.rootLociCacheSize:
+            self._rootLoci.popitem(last=False)
+        return loci
+
     def plot_root_locus(self, parameter, start, stop, num=50, axes='complex',
             parts='both', units='', factor=None, pub=False, width=4.,
-            xlim=None, ylim=None):
+            xlim=None, ylim=None, loci=None, decimate=True):
         """Returns a plot of the roots with respect to change in a single
         parameter.
 
@@ -623,6 +1812,15 @@ class LinearDynamicSystem(DynamicSystem):
             The parameter or equilibrium point provided to plot may not be what
             you want reflect. If you'd like to plot something proportional to
             the parameter, then provide a new parameter name
+        loci : tuple, optional
+            The (eValues, eVectors, values) returned by `root_locus`, so that
+            they are not calculated again. Otherwise the loci of the last few
+            calls are kept and reused while the parameters and equilibrium
+            point are unchanged.
+        decimate : boolean, optional
+            If true, the points of dense loci which fall on the same pixel are
+            only plotted once and the parameter plots are reduced to the
+            minimum and maximum in each pixel of the figure's width.
 
         Returns
         -------
@@ -636,8 +1834,12 @@ class LinearDynamicSystem(DynamicSystem):
         elif axes == 'parameter':
             sort=True
 
-        eValues, eVectors, parValues = self.root_locus(parameter, start, stop,
-                num=num, sort=sort)
+        plt = _pyplot()
+        if loci is None:
+            loci = self._cached_root_locus(parameter, start, stop, num)
+        eValues, eVectors, parValues = loci
+        if sort is True:
+            eValues, eVectors = self.sort_modes(eValues, eVectors)
 
         if factor is not None:
             parValues = factor[1] * parValues
@@ -662,14 +1864,23 @@ class LinearDynamicSystem(DynamicSystem):
         if pub is True:
             plt.axes([0.125, 0.2, 0.95 - 0.125, 0.7])
 
+        pixels = _pixel_width(rootLociFig)
+
         if axes == 'complex':
             x = eValues.real
             y = eValues.imag
             for i in range(x.shape[1]):
                 # don't plot the zero eigenvalues
                 if (abs(x[:, i] - np.zeros_like(x[:, i])) > 1e-14).any():
-                    plt.scatter(x[:, i], y[:, i], s=20, c=parValues,
-                            cmap=plt.cm.gist_rainbow, edgecolors='none')
+                    if decimate is True:
+                        keep = _distinct_pixels(x[:, i], y[:, i], x, y,
+                                pixels)
+                    else:
+                        keep = slice(None)
+                    plt.scatter(x[keep, i], y[keep, i], s=20,
+                            c=parValues[keep], vmin=parValues.min(),
+                            vmax=parValues.max(), cmap=plt.cm.gist_rainbow,
+                            edgecolors='none')
             cb = plt.colorbar()
             cb.set_label('{} [{}]'.format(parameter, units))
             plt.grid()
@@ -684,12 +1895,20 @@ class LinearDynamicSystem(DynamicSystem):
                 if (abs(eigenvalue.real - np.zeros_like(eigenvalue.real)) >
                         1e-14).any():
                     color = next(colors)
+                    if decimate is True:
+                        values, components = envelope(parValues,
+                                np.column_stack((eigenvalue.real,
+                                    eigenvalue.imag)), pixels)
+                        real, imag = components[:, 0], components[:, 1]
+                    else:
+                        values = parValues
+                        real, imag = eigenvalue.real, eigenvalue.imag
                     if parts == 'both' or parts == 'imaginary':
                         if (abs(eigenvalue.imag -
                             np.zeros_like(eigenvalue.imag)) > 1e-14).any():
-                           plt.plot(parValues, eigenvalue.imag, '--', color=color)
+                           plt.plot(values, imag, '--', color=color)
                     if parts == 'both' or parts == 'real':
-                        plt.plot(parValues, eigenvalue.real, '-', color=color)
+                        plt.plot(values, real, '-', color=color)
             plt.grid()
             plt.xlabel('{} [{}]'.format(parameter, units))
             plt.ylabel('Eigenvalue Component [$s^{-1}$]')
@@ -703,6 +1922,70 @@ class LinearDynamicSystem(DynamicSystem):
 
         return rootLociFig
 
+    def frequency_response(self, omegas, inputs=None, outputs=None):
+        """Returns the frequency response of the linear system,
+        C (jwI - A)^-1 B + D, at each of the frequencies.
+
+        Parameters
+        ----------
+        omegas : array_like, shape(k,)
+            The frequencies in radians per second.
+        inputs : list, optional
+            The names of the inputs to include, in order. The default is all
+            of the inputs.
+        outputs : list, optional
+            The names of the outputs to include, in order. The default is all
+            of the outputs.
+
+        Returns
+        -------
+        H : ndarray, shape(k, p, m)
+            The complex frequency response from each input to each output at
+            each frequency.
+
+        Notes
+        -----
+        The state matrix is decomposed once, A = V L V^-1, so that the
+        response at every frequency is a diagonal scaling. If the
+        eigenvectors are nearly dependent, e.g. for repeated eigenvalues, the
+        Hessenberg form, A = Q H Q^T, is used instead. The shifted systems
+        (jwI - H) are then upper Hessenberg too and each is solved by
+        elimination in O(n^2) operations, for all of the frequencies at once.
+
+        """
+        if inputs is None:
+            inputIndices = range(len(self.inputNames))
+        else:
+            inputIndices = [self.inputNames.index(i) for i in inputs]
+        if outputs is None:
+            outputIndices = range(len(self.outputNames))
+        else:
+            outputIndices = [self.outputNames.index(o) for o in outputs]
+
+        A = np.asarray(self.A, dtype=float)
+        B = np.reshape(self.B, (A.shape[0], -1))[:, inputIndices]
+        C = np.reshape(self.C, (-1, A.shape[0]))[outputIndices]
+        D = np.reshape(self.D, (len(self.outputNames),
+            -1))[np.ix_(outputIndices, inputIndices)]
+        s = 1j * np.asarray(omegas, dtype=float)
+
+        evals, V = eig(A)
+        if np.linalg.cond(V) < 1. / np.sqrt(np.finfo(float).eps):
+            CV = np.dot(C, V)
+            WB = np.linalg.solve(V, B)
+            H = np.einsum('pn,kn,nm->kpm', CV, 1. / (s[:, np.newaxis] -
+                evals[np.newaxis, :]), WB)
+        else:
+            from scipy.linalg import hessenberg
+            Hess, Q = hessenberg(A, calc_q=True)
+            QB = np.dot(Q.T, B)
+            shifted = (s[:, np.newaxis, np.newaxis] * np.eye(A.shape[0]) -
+                    Hess[np.newaxis])
+            X = _hessenberg_solve(shifted, np.tile(QB, (len(s), 1, 1)))
+            H = np.einsum('pn,knm->kpm', np.dot(C, Q), X)
+
+        return H + D[np.newaxis]
+
     def reduce_system(self, states, inputs, outputs):
         """Returns reduced state space matrices.
 
@@ -737,3 +2020,683 @@ class LinearDynamicSystem(DynamicSystem):
         D = self.D[np.ix_(outputIndices, inputIndices)]
 
         return A, B, C, D
+
+def envelope(x, y, size):
+    """Returns a decimated version of a long series which keeps the minimum
+    and maximum of each of a number of equal bins, so that a plot of it looks
+    the same as a plot of the full series at that resolution.
+
+    Parameters
+    ----------
+    x : ndarray, shape(n,)
+        The abscissa, e.g. time.
+    y : ndarray, shape(n,) or shape(n, p)
+        The series, one per column.
+    size : integer
+        The number of bins, e.g. the width of the plot in pixels.
+
+    Returns
+    -------
+    x : ndarray, shape(k,)
+    y : ndarray, shape(k,) or shape(k, p)
+        The decimated series, with k at most twice the number of bins. The
+        series are returned unchanged if they are already that short.
+
+    Notes
+    -----
+    Each bin contributes two points at the abscissa of its first sample, the
+    minimum and maximum of each column in the order they occur.
+
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if n <= 2 * size:
+        return x, y
+
+    oneD = y.ndim == 1
+    if oneD:
+        y = y[:, np.newaxis]
+
+    # pad the last bin with its last value so that the bins are equal
+    binSize = int(np.ceil(n / float(size)))
+    numBins = int(np.ceil(n / float(binSize)))
+    padded = np.empty((numBins * binSize, y.shape[1]), dtype=y.dtype)
+    padded[:n] = y
+    padded[n:] = y[-1]
+    bins = padded.reshape(numBins, binSize, y.shape[1])
+
+    low = bins.argmin(axis=1)
+    high = bins.argmax(axis=1)
+    columns = np.arange(y.shape[1])
+    rows = np.arange(numBins)[:, np.newaxis]
+    minimum = bins[rows, low, columns]
+    maximum = bins[rows, high, columns]
+    lowFirst = low <= high
+
+    decimated = np.empty((2 * numBins, y.shape[1]), dtype=y.dtype)
+    decimated[0::2] = np.where(lowFirst, minimum, maximum)
+    decimated[1::2] = np.where(lowFirst, maximum, minimum)
+    xDecimated = np.repeat(x[::binSize], 2)
+
+    if oneD:
+        decimated = decimated[:, 0]
+    return xDecimated, decimated
+
+def _pixel_width(fig):
+    """Returns the width of a figure in pixels."""
+    return int(fig.get_figwidth() * fig.dpi)
+
+def _distinct_pixels(x, y, allX, allY, pixels):
+    """Returns a boolean array which is false for the points which fall on
+    the same pixel as the point before them, with the pixel size set by the
+    extent of all of the points."""
+    size = max(np.ptp(allX), np.ptp(allY)) / pixels
+    keep = np.ones(len(x), dtype=bool)
+    if size > 0.:
+        cellX = np.floor((x - allX.min()) / size)
+        cellY = np.floor((y - allY.min()) / size)
+        keep[1:] = (cellX[1:] != cellX[:-1]) | (cellY[1:] != cellY[:-1])
+    return keep
+
+def _accepts_out(function):
+    """Returns true if the function or callable object takes an `out`
+    argument."""
+    function = getattr(function, '__wrapped__', function)
+    if not inspect.isfunction(function) and not inspect.ismethod(function):
+        function = function.__call__
+    return 'out' in inspect.getargspec(function).args
+
+def _profiled(method, counts):
+    """Returns a wrapper of the method which counts its calls and adds up its
+    time in the counts dictionary."""
+    def profiled(*args, **kwargs):
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            counts['time'] += time.time() - start
+            counts['calls'] += 1
+    profiled.__wrapped__ = method
+    profiled.__doc__ = method.__doc__
+    return profiled
+
+def _compiled_constants(cls):
+    """Returns the compiled code of each of the constant lines of a model
+    class, compiling them the first time they are needed."""
+    try:
+        return _compiledConstants[cls]
+    except KeyError:
+        code = [compile(line, '<constants of {}>'.format(cls.name), 'exec')
+                for line in cls.constantLines]
+        _compiledConstants[cls] = code
+        return code
+
+def _max_real(eigenvalues, zeroTol):
+    """Returns the largest real part of the eigenvalues along the last axis,
+    leaving out those with a magnitude below zeroTol. Without this the
+    eigenvalues of ignorable coordinates, which are zero give or take round
+    off, decide the stability."""
+    real = np.where(np.abs(eigenvalues) < zeroTol, -np.inf, eigenvalues.real)
+    return real.max(axis=-1)
+
+def _hessenberg_solve(M, R):
+    """Returns the solutions of the stacked upper Hessenberg systems
+    M[i] X[i] = R[i], shapes (k, n, n) and (k, n, m), by Gaussian
+    elimination with partial pivoting. Only the single subdiagonal has to be
+    eliminated, so each system takes O(n^2) operations per column of R. M
+    is overwritten."""
+    k, n = M.shape[:2]
+    R = np.array(R, dtype=np.result_type(M, R))
+    rows = np.arange(k)
+    for j in range(n - 1):
+        # swap rows j and j + 1 where the subdiagonal is the larger pivot
+        swap = rows[np.abs(M[:, j + 1, j]) > np.abs(M[:, j, j])]
+        upper = M[swap, j, j:]
+        M[swap, j, j:] = M[swap, j + 1, j:]
+        M[swap, j + 1, j:] = upper
+        upper = R[swap, j]
+        R[swap, j] = R[swap, j + 1]
+        R[swap, j + 1] = upper
+        factor = M[:, j + 1, j] / M[:, j, j]
+        M[:, j + 1, j:] -= factor[:, np.newaxis] * M[:, j, j:]
+        R[:, j + 1] -= factor[:, np.newaxis] * R[:, j]
+
+    # back substitution in the upper triangular systems
+    X = np.zeros_like(R)
+    for i in range(n - 1, -1, -1):
+        X[:, i] = (R[:, i] - np.einsum('kl,klm->km', M[:, i, i + 1:],
+            X[:, i + 1:])) / M[:, i, i][:, np.newaxis]
+    return X
+
+def _newton_kleinman(A, B, Q, R, Rinv, K, tol, maxIter):
+    """Returns the solution of the continuous algebraic Riccati equation
+    found by Newton-Kleinman iterations from the gain K, or None if K does not
+    stabilize the system or the iterations do not converge."""
+    from scipy.linalg import solve_continuous_lyapunov
+    P = None
+    for i in range(maxIter):
+        closed = A - np.dot(B, K)
+        if np.linalg.eigvals(closed).real.max() >= 0.:
+            return None
+        # closed^T P + P closed + Q + K^T R K = 0
+        Pnew = solve_continuous_lyapunov(closed.T, -(Q + np.dot(K.T,
+            np.dot(R, K))))
+        K = np.dot(Rinv, np.dot(B.T, Pnew))
+        if P is not None and (np.abs(Pnew - P).max() <= tol *
+                np.abs(Pnew).max()):
+            return Pnew
+        P = Pnew
+    return None
+
+def _trajectory_chunk(args):
+    """Returns the stacked A, B, C and D matrices of a chunk of a trajectory,
+    see `LinearDynamicSystem.linear_trajectory`. This is module level so that
+    it can be sent to worker processes."""
+    cls, parameters, X, U = args
+    system = cls()
+    system.parameters.update(parameters)
+    system.update_constants()
+    return system._jacobians(X, U)
+
+def _linear_chunk(args):
+    """Linearizes a system at each of a list of points and returns the
+    stacked A, B, C and D matrices. This is module level so that it can be
+    sent to worker processes.
+
+    Parameters
+    ----------
+    args : tuple
+        The system (or a LinearDynamicSystem subclass, which is instantiated
+        with the given parameters dictionary) and a list of (parameters,
+        equilibriumPoint) tuples.
+
+    """
+    system, parameters, points = args
+    if parameters is not None:
+        system = system()
+        system.parameters.update(parameters)
+        originalPoint = None
+    else:
+        originalPoint = np.array(system.equilibriumPoint, dtype=float)
+    original = dict(system.parameters)
+
+    # the numerical linearization evaluates all of the points which share a
+    # parameter set in one pass of the batch methods
+    numerical = (type(system).linear.__func__ is
+            LinearDynamicSystem.linear.__func__)
+
+    matrices = [None] * len(points)
+    try:
+        if numerical:
+            groups = collections.OrderedDict()
+            for i, (par, equilibriumPoint) in enumerate(points):
+                groups.setdefault(tuple(sorted(par.items())), []).append(i)
+            m = len(system.inputNames)
+            for par, indices in groups.items():
+                system.parameters.update(original)
+                system.parameters.update(par)
+                system.update_constants()
+                X = np.array([points[i][1] for i in indices], dtype=float)
+                stacks = system._jacobians(X, np.zeros((len(indices), m)))
+                for k, i in enumerate(indices):
+                    matrices[i] = [stack[k] for stack in stacks]
+        else:
+            for i, (par, equilibriumPoint) in enumerate(points):
+                system.parameters.update(par)
+                system.linear(equilibriumPoint)
+                matrices[i] = [np.array(mat, dtype=float) for mat in
+                        (system.A, system.B, system.C, system.D)]
+                for k in par:
+                    system.parameters[k] = original[k]
+    finally:
+        # set the model back to the default
+        system.parameters.update(original)
+        if numerical:
+            system.update_constants()
+        if originalPoint is not None:
+            system.linear(originalPoint)
+
+    return tuple(np.array([mats[i] for mats in matrices]) for i in range(4))
+
+class HeldInputs(object):
+    """A source of inputs which returns the same input vector at any time.
+
+    Parameters
+    ----------
+    u : array_like, shape(m,)
+        The input vector to hold.
+
+    """
+
+    def __init__(self, u):
+        self.u = np.asarray(u, dtype=float)
+
+    def __call__(self, t, out=None):
+        if out is None:
+            return self.u
+        out[:] = self.u
+        return out
+
+class RungeKutta4(object):
+    """The classical fourth order Runge-Kutta method with a fixed step.
+
+    The state is advanced in place and the stages are stored in preallocated
+    arrays, so no arrays are allocated per step if the derivative function
+    accepts an `out` argument. This gives deterministic stepping for real time
+    use, e.g. driving a hardware in the loop rig.
+
+    Parameters
+    ----------
+    f : function
+        The derivative function, f(x, t) or f(x, t, out=None).
+    n : integer
+        The number of states.
+
+    """
+
+    def __init__(self, f, n):
+        if _accepts_out(f):
+            self.f = f
+        else:
+            def buffered(x, t, out=None):
+                out[:] = f(x, t)
+                return out
+            self.f = buffered
+        self.k1 = np.zeros(n)
+        self.k2 = np.zeros(n)
+        self.k3 = np.zeros(n)
+        self.k4 = np.zeros(n)
+        self.xt = np.zeros(n)
+
+    def step(self, x, t, h):
+        """Advances the state one step in place.
+
+        Parameters
+        ----------
+        x : ndarray, shape(n,)
+            The state at time `t`, it is overwritten with the state at `t +
+            h`.
+        t : float
+            The time.
+        h : float
+            The step size.
+
+        Returns
+        -------
+        x : ndarray, shape(n,)
+            The state at `t + h`.
+
+        """
+        f, k1, k2, k3, k4, xt = (self.f, self.k1, self.k2, self.k3, self.k4,
+                self.xt)
+        f(x, t, out=k1)
+        np.multiply(k1, 0.5 * h, out=xt)
+        xt += x
+        f(xt, t + 0.5 * h, out=k2)
+        np.multiply(k2, 0.5 * h, out=xt)
+        xt += x
+        f(xt, t + 0.5 * h, out=k3)
+        np.multiply(k3, h, out=xt)
+        xt += x
+        f(xt, t + h, out=k4)
+        # x + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        k2 += k3
+        k2 *= 2.
+        k1 += k2
+        k1 += k4
+        k1 *= h / 6.
+        x += k1
+        return x
+
+class Stepper(object):
+    """Advances a system one interval at a time, with the inputs optionally
+    set between the steps. Use `DynamicSystem.stepper` to create one.
+
+    Parameters
+    ----------
+    system : DynamicSystem
+        The system, which starts from its initial conditions at the initial
+        time.
+    dt : float
+        The interval of each step.
+    integrator : string, optional
+        Either 'odeint' or 'rk4', the default is the system's `integrator`.
+
+    Notes
+    -----
+    Once inputs are given to `step` they are held by the system until the
+    next inputs are given, and the system's previous input source is restored
+    by `close`. Iterating over a stepper steps it forever and yields the time
+    and state.
+
+    """
+
+    def __init__(self, system, dt, integrator=None):
+        if integrator is None:
+            integrator = system.integrator
+        if integrator not in ('odeint', 'rk4'):
+            raise ValueError('{} is not a valid integrator.'.format(
+                integrator))
+        self.system = system
+        self.dt = dt
+        self.integrator = integrator
+        self.previousSource = system.__dict__.get('inputs')
+        self.held = None
+
+        system.constants()
+        self.t = system.intOpts['ti']
+        self.x = np.array(system.initialConditions, dtype=float)
+        self.derivatives = np.zeros_like(self.x)
+        self.y = np.zeros(len(system.outputNames))
+
+        if integrator == 'rk4':
+            self.rk4 = RungeKutta4(system.f, len(self.x))
+            self.solver = None
+        else:
+            if _accepts_out(system.f):
+                derivatives = np.zeros_like(self.x)
+                def rhs(t, x):
+                    return system.f(x, t, out=derivatives)
+            else:
+                rhs = lambda t, x: system.f(x, t)
+            from scipy.integrate import ode
+            self.solver = ode(rhs)
+            self.solver.set_integrator('lsoda',
+                    atol=system.intOpts['abserr'],
+                    rtol=system.intOpts['relerr'])
+            self.solver.set_initial_value(self.x, self.t)
+
+    def set_inputs(self, u):
+        """Holds the inputs at the given values from the current time.
+
+        Parameters
+        ----------
+        u : array_like, shape(m,)
+            The input vector.
+
+        """
+        if self.held is None:
+            self.held = HeldInputs(np.array(u, dtype=float))
+            self.system.set_input_source(self.held)
+        elif (self.held.u == u).all():
+            return
+        else:
+            self.held.u[:] = u
+        # the inputs jump, so the solver's history is no longer valid
+        if self.solver is not None:
+            self.solver.set_initial_value(self.x, self.t)
+
+    def step(self, u=None):
+        """Advances the system by one interval.
+
+        Parameters
+        ----------
+        u : array_like, shape(m,), optional
+            If given, the inputs are held at these values from now on.
+
+        Returns
+        -------
+        x : ndarray, shape(n,)
+            The state at the end of the interval.
+
+        """
+        if u is not None:
+            self.set_inputs(u)
+        t = self.t + self.dt
+        if self.solver is None:
+            h = self.dt / self.system.fixedSteps
+            for k in range(self.system.fixedSteps):
+                self.rk4.step(self.x, self.t + k * h, h)
+        else:
+            self.solver.integrate(t)
+            if not self.solver.successful():
+                raise RuntimeError('The integration failed at t = '
+                        '{}.'.format(self.solver.t))
+            self.x[:] = self.solver.y
+        self.t = t
+        self.system.t = t
+        self.system.x = self.x
+        return self.x
+
+    def outputs(self):
+        """Returns the outputs at the current state."""
+        system = self.system
+        # the outputs may use the zees set by f
+        if _accepts_out(system.f):
+            system.f(self.x, self.t, out=self.derivatives)
+        else:
+            system.f(self.x, self.t)
+        if _accepts_out(system.outputs):
+            return system.outputs(self.x, out=self.y)
+        else:
+            return system.outputs(self.x)
+
+    def close(self):
+        """Restores the system's input source from before stepping."""
+        if self.held is not None:
+            self.system.set_input_source(self.previousSource)
+            self.held = None
+
+    def __iter__(self):
+        # the time at the end of the step goes with the state
+        while True:
+            x = self.step()
+            yield self.t, x
+
+class TabulatedInputs(object):
+    """A source of inputs which linearly interpolates sampled input
+    histories. The inputs are held at the first and last samples outside of
+    the table.
+
+    Parameters
+    ----------
+    t : array_like, shape(k,)
+        The increasing sample times.
+    u : array_like, shape(k, m)
+        The input vectors at each sample time.
+
+    Notes
+    -----
+    The interval of the last call is remembered, so the calls made by the
+    integrator, which mostly move forward in small steps, find their interval
+    in constant time. Only calls far from the last one fall back to a binary
+    search.
+
+    """
+
+    def __init__(self, t, u):
+        self.t = np.asarray(t, dtype=float)
+        self.u = np.asarray(u, dtype=float).reshape(len(self.t), -1)
+        if len(self.t) < 2:
+            raise ValueError('At least two samples are needed.')
+        if (np.diff(self.t) <= 0.).any():
+            raise ValueError('The sample times must be increasing.')
+        # the slope of each interval
+        self.slopes = np.diff(self.u, axis=0) / np.diff(self.t)[:, np.newaxis]
+        self.index = 0
+
+    def interval(self, t):
+        """Returns the index of the interval containing the time."""
+        times = self.t
+        i = self.index
+        if times[i] <= t:
+            # step forward a few intervals before searching
+            for k in range(4):
+                if i + 1 == len(times) - 1 or t < times[i + 1]:
+                    self.index = i
+                    return i
+                i += 1
+        i = int(np.searchsorted(times, t, side='right')) - 1
+        i = min(max(i, 0), len(times) - 2)
+        self.index = i
+        return i
+
+    def __call__(self, t, out=None):
+        if out is None:
+            out = np.zeros(self.u.shape[1])
+        times = self.t
+        if t <= times[0]:
+            out[:] = self.u[0]
+        elif t >= times[-1]:
+            out[:] = self.u[-1]
+        else:
+            i = self.interval(t)
+            np.multiply(self.slopes[i], t - times[i], out=out)
+            out += self.u[i]
+        return out
+
+    def evaluate(self, times):
+        """Returns the inputs at each of the times.
+
+        Parameters
+        ----------
+        times : array_like, shape(n,)
+            The times.
+
+        Returns
+        -------
+        u : ndarray, shape(n, m)
+            The input vectors, one per row.
+
+        """
+        times = np.clip(np.asarray(times, dtype=float), self.t[0], self.t[-1])
+        i = np.searchsorted(self.t, times, side='right') - 1
+        i = np.clip(i, 0, len(self.t) - 2)
+        return self.u[i] + self.slopes[i] * (times - self.t[i])[:, np.newaxis]
+
+class SimulationStore(object):
+    """An appendable on-disk store of simulation results.
+
+    The results are kept in a directory as a header file and a series of
+    numbered chunk files, each holding a contiguous slice of the `t`, `x`, `u`
+    and `y` time histories. Chunks are written to a temporary file and then
+    renamed, so a reader never sees a partially written chunk and can consume
+    the completed chunks while the simulation is still running.
+
+    Parameters
+    ----------
+    path : string
+        The directory of the store.
+
+    """
+
+    headerName = 'header.p'
+    completeName = 'complete'
+    chunkName = 'chunk{:06d}.npz'
+
+    def __init__(self, path):
+        self.path = path
+        self.numChunks = 0
+
+    def create(self, header):
+        """Prepares an empty store, removing any previous results.
+
+        Parameters
+        ----------
+        header : dictionary
+            Information about the simulation, e.g. the model name and
+            parameters, which is saved with the results.
+
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        for filename in os.listdir(self.path):
+            if filename.startswith('chunk') or filename in (self.headerName,
+                    self.completeName):
+                os.remove(os.path.join(self.path, filename))
+
+        import pickle
+        with open(os.path.join(self.path, self.headerName), 'wb') as f:
+            pickle.dump(header, f)
+
+        self.numChunks = 0
+
+    def append(self, **arrays):
+        """Writes a new chunk to the store.
+
+        Parameters
+        ----------
+        arrays : ndarray
+            The arrays of the chunk given as keyword arguments, e.g. t, x, u
+            and y.
+
+        """
+        filename = os.path.join(self.path, self.chunkName.format(self.numChunks))
+        temporary = filename + '.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(temporary, filename)
+        self.numChunks += 1
+
+    def close(self):
+        """Marks the store as complete."""
+        open(os.path.join(self.path, self.completeName), 'w').close()
+
+    def header(self):
+        """Returns the header dictionary of the store."""
+        import pickle
+        with open(os.path.join(self.path, self.headerName), 'rb') as f:
+            return pickle.load(f)
+
+    def is_complete(self):
+        """Returns true if the simulation has finished writing the store."""
+        return os.path.isfile(os.path.join(self.path, self.completeName))
+
+    def chunks(self, follow=False, poll=0.5, timeout=None):
+        """Yields the completed chunks in order.
+
+        Parameters
+        ----------
+        follow : boolean, optional
+            If true, the generator waits for new chunks until the store is
+            marked complete. If false, it stops at the last completed chunk.
+        poll : float, optional
+            The time in seconds to wait between checks for new chunks when
+            following.
+        timeout : float, optional
+            The longest time in seconds to wait for the next chunk when
+            following. If it passes without a new chunk and the store is still
+            not complete, e.g. because the writer died before `close`, an
+            IOError is raised. The default waits forever.
+
+        Returns
+        -------
+        chunks : generator
+            Yields a dictionary of arrays for each chunk.
+
+        """
+        i = 0
+        waited = 0.
+        while True:
+            filename = os.path.join(self.path, self.chunkName.format(i))
+            if os.path.isfile(filename):
+                with np.load(filename) as data:
+                    chunk = dict((k, data[k]) for k in data.files)
+                yield chunk
+                i += 1
+                waited = 0.
+            elif follow and not self.is_complete():
+                if timeout is not None and waited >= timeout:
+                    raise IOError('No new chunk was written to {} in {} s '
+                            'and the store is not complete.'.format(
+                                self.path, timeout))
+                time.sleep(poll)
+                waited += poll
+            elif not os.path.isfile(filename):
+                # the last chunk may have been written just before the store
+                # was marked complete, so only stop if it still isn't there
+                break
+
+    def load(self):
+        """Returns all of the completed chunks joined together in the same
+        form as `DynamicSystem.simResults`."""
+        header = self.header()
+        chunks = list(self.chunks())
+        results = {}
+        for k in ('t', 'x', 'u', 'y'):
+            results[k] = np.concatenate([chunk[k] for chunk in chunks])
+        results['model'] = header['model']
+        results['params'] = header['params']
+        return results
@@ -0,0 +1,322 @@
+"""Compiles models from the plain text format written by alparse, e.g.
+Whipple.txt, straight into DynamicSystem classes in memory, without writing a
+Python file.
+
+    >>> from altk import modelcompiler
+    >>> module = modelcompiler.load_text('models/Whipple/Whipple.txt')
+    >>> whipple = module.LinearWhipple()
+
+The code objects are cached by the hash of the text, so loading a model again,
+e.g. from a model store on demand, only executes the class definitions.
+
+A `ModelHandle` keeps a model up to date with its .txt or generated .py file
+while the model is being developed, so long running processes pick up the
+regenerated model without a restart.
+
+"""
+import collections
+import hashlib
+import linecache
+import os
+import sys
+import threading
+import types
+import weakref
+
+from altk import alparse
+
+# the number of compiled models which are kept
+codeCacheSize = 32
+
+_codeCache = collections.OrderedDict()
+
+# guards the cache, which a ModelHandle changes from its thread
+_codeCacheLock = threading.Lock()
+
+# the weak references to the old versions of the models of the handles, which
+# remove their modules once the old versions are collected
+_retired = {}
+
+def _compile(key, filename, generate):
+    """Returns the model name, the module name, the source and the code for
+    the key, calling generate for the model name and the source only when
+    the key is not in the cache."""
+    key = hashlib.sha1((repr(filename) + key).encode('utf-8')).hexdigest()
+    with _codeCacheLock:
+        compiled = _codeCache.pop(key, None)
+        if compiled is not None:
+            _codeCache[key] = compiled
+            return compiled
+
+    # compile without holding the lock, the first of two threads compiling
+    # the same key to finish is kept
+    className, source = generate()
+    moduleName = className + '_' + key[:12]
+    # the code is the generated source, not the text in the file, so it is
+    # compiled under a name of its own which _execute gives to linecache
+    if filename is None:
+        filename = '<altk:' + moduleName + '>'
+    else:
+        filename = '<altk:' + os.path.basename(filename) + '>'
+    code = compile(source, filename, 'exec')
+    compiled = (className, moduleName, source, code)
+
+    with _codeCacheLock:
+        compiled = _codeCache.pop(key, compiled)
+        _codeCache[key] = compiled
+        while len(_codeCache) > codeCacheSize:
+            _codeCache.popitem(last=False)
+    return compiled
+
+def _execute(compiled):
+    """Returns a new module with the compiled code executed in it."""
+    className, moduleName, source, code = compiled
+
+    # let tracebacks show the lines of the generated source
+    linecache.cache[code.co_filename] = (len(source), None,
+            source.splitlines(True), code.co_filename)
+
+    module = types.ModuleType(moduleName)
+    module.__file__ = code.co_filename
+    exec(code, module.__dict__)
+    sys.modules[moduleName] = module
+    return module
+
+def _retire(model):
+    """Removes the module of an old version of a model from `sys.modules`
+    once the model is collected, so that it can be pickled until then."""
+    name = model.__module__
+    module = sys.modules.get(name)
+
+    def release(ref):
+        del _retired[id(ref)]
+        # unless the same text was compiled into a new module meanwhile
+        if sys.modules.get(name) is module:
+            del sys.modules[name]
+
+    ref = weakref.ref(model, release)
+    _retired[id(ref)] = ref
+
+def compile_text(text, matrixNames=('A', 'B', 'C', 'D'), filename=None):
+    """Returns a module with the classes of a model compiled from its text.
+
+    Parameters
+    ----------
+    text : string
+        The contents of a model's .txt file.
+    matrixNames : tuple, optional
+        The names of the A, B, C and D matrices in the [Linear] section.
+    filename : string, optional
+        The file the text was read from. Tracebacks show the generated source
+        under its name, e.g. "<altk:Whipple.txt>".
+
+    Returns
+    -------
+    module : module
+        A new module with the model class, e.g. `Whipple`, and its linear
+        version, e.g. `LinearWhipple`.
+
+    Notes
+    -----
+    The module is registered in `sys.modules` under the model name and the
+    start of the hash of the text, so that the classes can be pickled, e.g.
+    for the `processes` options of `LinearDynamicSystem`. Compiling the same
+    text again replaces the registered module with a new one.
+
+    """
+    def generate():
+        className, inFileStrings, cFileStrings = alparse.parse_text(text)
+        return className, alparse.python_source(inFileStrings, cFileStrings,
+                className, matrixNames)
+    return _execute(_compile(repr(tuple(matrixNames)) + text, filename,
+        generate))
+
+def compile_source(source, className, filename=None):
+    """Returns a module with the classes of a model compiled from the source
+    of its generated Python file, see `compile_text`.
+
+    Parameters
+    ----------
+    source : string
+        The contents of a model's .py file.
+    className : string
+        The name of the model, e.g. 'Whipple'.
+    filename : string, optional
+        The file the source was read from, used in tracebacks.
+
+    Returns
+    -------
+    module : module
+        A new module with the classes defined in the source.
+
+    """
+    return _execute(_compile(source, filename, lambda: (className, source)))
+
+def load_text(path, matrixNames=('A', 'B', 'C', 'D')):
+    """Returns a module with the classes of the model in a .txt file, see
+    `compile_text`."""
+    with open(path) as f:
+        text = f.read()
+    return compile_text(text, matrixNames=matrixNames, filename=path)
+
+class ModelHandle(object):
+    """A model instance which is recompiled from its .txt or generated .py
+    file whenever the contents of the file change.
+
+    The file is polled by a background thread. When its contents change the
+    model is compiled and instantiated in the thread, then swapped in as a
+    whole, and the old instance serves until then. If the new version fails
+    to compile the old one is kept and the exception is stored in `error`.
+    The module of the old version is removed from `sys.modules` once the old
+    instance is collected, so a long running process does not accumulate
+    every version while the old instance can still be pickled. Instances
+    which are created from the classes of the old version, rather than by the
+    handle, can only be pickled while the old instance is alive.
+
+        >>> handle = ModelHandle('models/Whipple/Whipple.txt', linear=True)
+        >>> handle.linear(x) # calls the current LinearWhipple instance
+
+    Attributes
+    ----------
+    model : DynamicSystem
+        The current instance of the model.
+    version : integer
+        The number of times the model has been loaded.
+    error : Exception or None
+        The exception raised by the last failed reload.
+
+    """
+
+    def __init__(self, path, linear=False, interval=1.0,
+            matrixNames=('A', 'B', 'C', 'D'), keepParameters=True,
+            start=True):
+        """
+        Parameters
+        ----------
+        path : string
+            The path to the model's .txt or generated .py file.
+        linear : boolean, optional
+            If true the Linear version of the model is instantiated.
+        interval : float, optional
+            The time in seconds between checks of the file.
+        matrixNames : tuple, optional
+            The names of the A, B, C and D matrices in a .txt file.
+        keepParameters : boolean, optional
+            If true the parameter values of the old instance are given to the
+            new one, for the parameters which both have.
+        start : boolean, optional
+            If true the background thread is started.
+
+        """
+        self.path = path
+        self.useLinear = linear
+        self.interval = interval
+        self.matrixNames = matrixNames
+        self.keepParameters = keepParameters
+        self.error = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._stat = None
+        self._digest = None
+        # the instance and its version are swapped together
+        self._current = (None, 0)
+        # the first load raises any error
+        self.reload()
+        if start:
+            self.start()
+
+    @property
+    def model(self):
+        return self._current[0]
+
+    @property
+    def version(self):
+        return self._current[1]
+
+    def __getattr__(self, name):
+        # the attributes of the handle are found first, anything else is
+        # looked up on the current model
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._current[0], name)
+
+    def _load(self, text):
+        """Returns a new instance of the model compiled from the text."""
+        if self.path.endswith('.py'):
+            className = os.path.splitext(os.path.basename(self.path))[0]
+            module = compile_source(text, className, filename=self.path)
+        else:
+            module = compile_text(text, matrixNames=self.matrixNames,
+                    filename=self.path)
+            className = module.__name__.rsplit('_', 1)[0]
+        if self.useLinear:
+            className = 'Linear' + className
+        return getattr(module, className)()
+
+    def reload(self, force=False):
+        """Compiles the model again if the contents of the file changed.
+
+        Parameters
+        ----------
+        force : boolean, optional
+            If true the model is compiled even if the file did not change.
+
+        Returns
+        -------
+        reloaded : boolean
+            True if a new instance was swapped in.
+
+        """
+        with self._lock:
+            stat = os.stat(self.path)
+            stat = (stat.st_mtime, stat.st_size)
+            if stat == self._stat and not force:
+                return False
+            with open(self.path) as f:
+                text = f.read()
+            digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            self._stat = stat
+            if digest == self._digest and not force:
+                return False
+
+            model = self._load(text)
+            old, version = self._current
+            if self.keepParameters and old is not None:
+                for p in model.parameters:
+                    if p in old.parameters:
+                        model.parameters[p] = old.parameters[p]
+                model.constants()
+            self._digest = digest
+            self._current = (model, version + 1)
+
+            # forget the old version once it is gone, unless the new one
+            # replaced it
+            if old is not None and old.__module__ != model.__module__:
+                _retire(old)
+            return True
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if self.reload():
+                    self.error = None
+            except Exception as e:
+                self.error = e
+
+    def start(self):
+        """Starts watching the file in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch,
+                name='ModelHandle(' + self.path + ')')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops watching the file."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
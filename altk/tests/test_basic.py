@@ -34,3 +34,33 @@ def test_equation_lines_to_dictionary():
     dictionary = {'a':'b','c':'a + b + d','b':'2*3*b/5'}
     result = alp.equation_lines_to_dictionary(lines)
     assert result == dictionary
+
+def test_constant_dependencies():
+    constants = 'd1 = a*b\nd2 = 2*d1\nz[3] = c + d2\nz[4] = c\n'
+    result = alp.constant_dependencies(constants, ['a', 'b', 'c', 'e'])
+    assert result == {'a':[0, 1, 2], 'b':[0, 1, 2], 'c':[2, 3], 'e':[]}
+
+def test_constants_lines():
+    constants = 'd1 = a*b\nd2 = d1*d1 + 1.5e2\nz[3] = d2.real + z[1]\n'
+    result = alp.constants_lines(constants)
+    lines = ("        self.parameters['d1'] = a*b\n"
+             "        self.parameters['d2'] = self.parameters['d1']*"
+             "self.parameters['d1'] + 1.5e2\n"
+             "        self.z[3] = self.parameters['d2'].real + self.z[1]\n")
+    assert result == lines
+
+def test_extract_kinematical():
+    odefun = 'q1p = u1\nq10p = u10\nz[1] = q1\nu1p = z[1]\n'
+    result = alp.extract_kinematical(odefun, ['q1', 'q10', 'u1', 'u10'])
+    assert result == '        q1p = u1\n        q10p = u10\n        u1p = z[1]\n'
+
+def test_parse_text():
+    text = ('[Name]\nSpring\n\n[Parameters]\nk = 2.0, N/m\n\n[States]\n'
+            'x = 1.0, m\nv = 0.0, m/s\n\n[Equations of Motion]\nz[1] = k*x\n'
+            'xp = v\nvp = -z[1]\n\n[Dependent Variables]\n'
+            '        e = self.z[1]*x\n\n[Output Names]\nx\ne\n\n[Linear]\n')
+    className, inFileStrings, cFileStrings = alp.parse_text(text)
+    assert className == 'Spring'
+    assert inFileStrings == ('', 'k = 2.0\n', 'x = 1.0\nv = 0.0\n')
+    assert cFileStrings == (['z[2]'], '', 'z[1] = k*x\nxp = v\nvp = -z[1]\n',
+            '', '', '', ['x', 'e'], '        e = self.z[1]*x\n')
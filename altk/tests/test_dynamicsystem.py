@@ -0,0 +1,413 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+import dynamicsystem as ds
+
+def test_simulation_store():
+    path = tempfile.mkdtemp()
+    try:
+        store = ds.SimulationStore(path)
+        store.create({'model' : 'Test', 'params' : {'a' : 1.0}})
+        t = np.linspace(0., 1., 10)
+        x = np.random.random((10, 2))
+        store.append(t=t[:6], x=x[:6])
+        assert not store.is_complete()
+        store.append(t=t[6:], x=x[6:])
+        store.close()
+        assert store.is_complete()
+        chunks = list(ds.SimulationStore(path).chunks(follow=True))
+        assert len(chunks) == 2
+        assert (np.concatenate([c['x'] for c in chunks]) == x).all()
+        assert store.header()['params'] == {'a' : 1.0}
+    finally:
+        shutil.rmtree(path)
+
+def test_simulation_store_timeout():
+    path = tempfile.mkdtemp()
+    try:
+        store = ds.SimulationStore(path)
+        store.create({'model' : 'Test'})
+        store.append(t=np.zeros(2), x=np.zeros((2, 2)))
+        # the writer never closes the store
+        chunks = ds.SimulationStore(path).chunks(follow=True, poll=0.01,
+                timeout=0.05)
+        assert next(chunks)['t'].shape == (2,)
+        try:
+            next(chunks)
+        except IOError:
+            pass
+        else:
+            raise AssertionError('The follow did not time out.')
+    finally:
+        shutil.rmtree(path)
+
+class PlainInputs(ds.DynamicSystem):
+    """Overrides inputs without the out argument."""
+
+    def inputs(self, t):
+        return np.array([2.0])
+
+def test_plain_inputs():
+    sys = PlainInputs()
+    assert sys.f(np.zeros(2), 0.)[1] == 1.0 + 2.0 * 2.0
+    # as does an input function assigned directly
+    sys.inputs = lambda t: np.array([3.0])
+    assert sys.f(np.zeros(2), 0.)[1] == 1.0 + 2.0 * 3.0
+    del sys.inputs
+    assert sys.f(np.zeros(2), 0.)[1] == 1.0 + 2.0 * 2.0
+
+def test_outputs_batch():
+    sys = ds.DynamicSystem()
+    X = np.random.random((5, 2))
+    Y = sys.outputs_batch(X)
+    assert (Y == np.array([sys.outputs(x) for x in X])).all()
+    # the model's own inputs are restored afterwards
+    assert 'inputs' not in sys.__dict__
+
+def test_linear_outputs_batch():
+    sys = ds.LinearDynamicSystem()
+    sys.linear(np.zeros(2))
+    sys.D = np.ones((2, 1))
+    X = np.random.random((5, 2))
+    U = np.ones((5, 1))
+    # the feedforward is left out by both outputs and outputs_batch
+    Y = sys.outputs_batch(X, U)
+    assert np.allclose(Y, np.array([sys.outputs(x) for x in X]))
+
+def test_sort_modes():
+    # a complex pair and a zero eigenvalue which is removed
+    steps = np.linspace(0., 1., 10)
+    evals = np.column_stack((-1. + steps + 2j, -1. + steps - 2j,
+        np.zeros_like(steps)))
+    evecs = np.tile(np.eye(3, dtype=complex), (len(steps), 1, 1))
+    # shuffle the order at every other step like eig may do
+    evals[1::2] = evals[1::2][:, [2, 1, 0]]
+    evecs[1::2] = evecs[1::2][:, :, [2, 1, 0]]
+    sys = ds.LinearDynamicSystem()
+    sortedEvals, sortedEvecs = sys.sort_modes(evals, evecs)
+    assert sortedEvals.shape == (10, 2)
+    assert np.allclose(sortedEvals[:, 0], -1. + steps + 2j)
+    assert np.allclose(sortedEvals[:, 1], -1. + steps - 2j)
+    assert np.allclose(sortedEvecs[:, 1, 1], 1.)
+
+def test_sort_modes_crossing():
+    # two real modes which cross, only the eigenvectors tell them apart
+    steps = np.linspace(-1., 1., 10)
+    evals = np.column_stack((steps, -steps)).astype(complex)
+    evecs = np.tile(np.eye(2, dtype=complex), (len(steps), 1, 1))
+    evals[5:] = evals[5:][:, [1, 0]]
+    evecs[5:] = evecs[5:][:, :, [1, 0]]
+    sys = ds.LinearDynamicSystem()
+    sortedEvals, sortedEvecs = sys.sort_modes(evals, evecs, vectorWeight=10.)
+    assert np.allclose(sortedEvals[:, 0], steps)
+    assert np.allclose(sortedEvals[:, 1], -steps)
+
+def test_linear():
+    sys = ds.LinearDynamicSystem()
+    sys.linear(np.array([0.5, 0.1]))
+    assert np.allclose(sys.A, [[0., 1.], [0., 0.]])
+    assert np.allclose(sys.B, [[0.], [2.]])
+    assert np.allclose(sys.C, np.eye(2))
+    assert np.allclose(sys.D, np.zeros((2, 1)))
+
+def test_bind_parameters():
+    sys = ds.DynamicSystem()
+    assert sys.boundParameters == (1.0, 2.0)
+    x = np.zeros(2)
+    sys.set_input_source(ds.HeldInputs(np.array([1.0])))
+    try:
+        sys.set_parameters({'b' : 3.0})
+        assert sys.boundParameters == (1.0, 3.0)
+        assert sys.f(x, 0.)[1] == 4.0
+    finally:
+        sys.set_parameters({'b' : 2.0})
+
+def test_tabulated_inputs():
+    t = np.linspace(0., 1., 11)
+    u = np.column_stack((np.sin(t), t**2))
+    source = ds.TabulatedInputs(t, u)
+    times = np.hstack((np.linspace(-0.5, 1.5, 41), [0.55, 0.05, 0.95]))
+    expected = np.column_stack([np.interp(times, t, col) for col in u.T])
+    # calls going both forwards and backwards in time
+    out = np.zeros(2)
+    for time, row in zip(times, expected):
+        assert np.allclose(source(time, out=out), row)
+    assert np.allclose(source.evaluate(times), expected)
+
+    sys = ds.DynamicSystem()
+    sys.set_input_table(t, t)
+    try:
+        assert np.allclose(sys.inputs(0.25), [0.25])
+    finally:
+        sys.set_input_source(None)
+
+def test_rk4():
+    # x'' = -x
+    def f(x, t, out=None):
+        out[0] = x[1]
+        out[1] = -x[0]
+        return out
+    rk4 = ds.RungeKutta4(f, 2)
+    x = np.array([1., 0.])
+    h = 0.01
+    for i in range(100):
+        rk4.step(x, i * h, h)
+    assert np.allclose(x, [np.cos(1.), -np.sin(1.)], atol=1e-9)
+
+    sys = ds.DynamicSystem()
+    sys.integrator = 'rk4'
+    sys.set_input_source(ds.HeldInputs(np.array([1.0])))
+    try:
+        t = np.linspace(0., 1., 11)
+        X = np.array([x.copy() for x in sys.state_history(t)])
+        # x2' = a + b * u = 3
+        assert np.allclose(X[:, 0], 1.5 * t**2)
+        assert np.allclose(X[:, 1], 3. * t)
+    finally:
+        sys.set_input_source(None)
+
+def test_stepper():
+    sys = ds.DynamicSystem()
+    for integrator in ('odeint', 'rk4'):
+        stepper = sys.stepper(0.1, integrator=integrator)
+        try:
+            for i in range(5):
+                x = stepper.step(np.array([1.0]))
+            # x2' = a + b * u
+            assert np.allclose(x, [1.5 * 0.5**2, 1.5], atol=1e-6)
+            for i in range(5):
+                x = stepper.step(np.array([-0.5]))
+            assert np.allclose(x, [0.375 + 0.75, 1.5], atol=1e-6)
+            assert np.allclose(stepper.t, 1.0)
+            assert np.allclose(stepper.outputs(), sys.outputs(x))
+            t, x = next(iter(stepper))
+            assert np.allclose(t, 1.1)
+            assert x is stepper.x
+        finally:
+            stepper.close()
+        assert 'inputs' not in sys.__dict__
+
+class Damped(ds.DynamicSystem):
+    """A spring and damper whose damping can be negative."""
+
+    parameters = {'k' : 1.0,
+                  'c' : 0.5}
+    boundParameterNames = ['k', 'c']
+
+    def f(self, x, t, out=None):
+        k, c = self.boundParameters
+        if out is None:
+            out = np.zeros_like(x)
+        out[0] = x[1]
+        out[1] = -k * x[0] - c * x[1]
+        return out
+
+    def outputs(self, x, out=None):
+        return np.array(x)
+
+class LinearDamped(ds.LinearDynamicSystem, Damped):
+    pass
+
+def test_sweep():
+    sys = LinearDamped()
+    sys.linear(np.zeros(2))
+    k = np.array([0.5, 1.0, 2.0])
+    c = np.linspace(-1., 1., 9)
+    sweep = sys.sweep([('k', k), ('c', c)])
+    assert sweep['eigenvalues'].shape == (3, 9, 2)
+    assert (sweep['stable'] == (c > 0.)[np.newaxis, :]).all()
+    # only the damping crosses the boundary, at zero
+    assert np.isnan(sweep['crossings'][0]).all()
+    crossings = sweep['crossings'][1]
+    assert crossings.shape == (3, 8)
+    assert np.allclose(crossings[~np.isnan(crossings)], 0.)
+    assert (~np.isnan(crossings)).sum(axis=1).tolist() == [1, 1, 1]
+    assert sys.parameters == {'k' : 1.0, 'c' : 0.5}
+
+class Rolling(Damped):
+    """The spring and damper on a cart whose position is ignorable."""
+
+    stateNames = ['x', 'v', 'p']
+    outputNames = ['x', 'v', 'p']
+
+    def f(self, x, t, out=None):
+        out = Damped.f(self, x, t, out=out)
+        out[2] = 1. + x[1]
+        return out
+
+class LinearRolling(ds.LinearDynamicSystem, Rolling):
+    pass
+
+def test_sweep_ignorable():
+    sys = LinearRolling()
+    sys.linear(np.zeros(3))
+    c = np.linspace(-1., 1., 9)
+    p = np.array([0., 10.])
+    sweep = sys.sweep([('c', c), ('p', p)])
+    # the position has a zero eigenvalue, which is left out
+    assert (sweep['stable'] == (c > 0.)[:, np.newaxis]).all()
+    crossings = sweep['crossings'][0]
+    assert np.allclose(crossings[~np.isnan(crossings)], 0.)
+    assert (~np.isnan(crossings)).sum(axis=0).tolist() == [1, 1]
+    # the batched linearization matches the one point at a time
+    A = sys.linear_batch(sys.sweep_points(['c', 'p'], [[0.5, 10.]]))[0]
+    sys.set_parameters({'k' : 1.0, 'c' : 0.5})
+    sys.linear(np.array([0., 0., 10.]))
+    assert np.allclose(A[0], sys.A)
+
+def test_linear_cache_options():
+    sys = LinearDamped()
+    sys.linear(np.zeros(2))
+    sys.linear(np.zeros(2))
+    # other differentiation options are not served from the cache
+    sys.linear(np.zeros(2), step=1e-3)
+    info = sys.linear_cache_info()
+    assert (info['hits'], info['misses'], info['size']) == (1, 2, 2)
+
+def test_adaptive_root_locus():
+    sys = LinearDamped()
+    sys.linear(np.zeros(2))
+    evals, evecs, c = sys.root_locus('c', -1., 3., num=5, adaptive=True,
+            tol=0.1, xtol=1e-6)
+    assert (np.diff(c) > 0.).all()
+    assert c[0] == -1. and c[-1] == 3.
+    # the crossing at zero damping is bracketed
+    stable = evals.real.max(axis=1) < 0.
+    i = np.nonzero(stable[:-1] != stable[1:])[0]
+    assert len(i) == 1
+    assert c[i[0] + 1] - c[i[0]] <= 1e-6
+    assert abs(c[i[0]]) <= 1e-6
+    # the eigenvalues coalesce at c = 2, so the values are denser there
+    near = np.abs(c - 2.) < 0.25
+    far = np.abs(c - 2.75) < 0.25
+    assert near.sum() > far.sum()
+    assert np.allclose(np.sort_complex(evals[-1]),
+            np.sort_complex(np.roots([1., 3., 1.])))
+
+def test_adaptive_root_locus_ignorable():
+    sys = LinearRolling()
+    sys.linear(np.zeros(3))
+    evals, evecs, c = sys.root_locus('c', -1., 1., num=5, adaptive=True,
+            xtol=1e-6)
+    # the values are refined about the crossing at zero damping
+    assert (np.abs(c) <= 1e-6).sum() >= 2
+    assert len(c) < 60
+
+def test_frequency_response():
+    sys = ds.LinearDynamicSystem()
+    sys.linear(np.zeros(2))
+    omegas = np.logspace(-1., 1., 20)
+    s = 1j * omegas
+    # A is a Jordan block, so the Hessenberg form is used
+    H = sys.frequency_response(omegas)
+    assert H.shape == (20, 2, 1)
+    assert np.allclose(H[:, 0, 0], 2. / s**2)
+    assert np.allclose(H[:, 1, 0], 2. / s)
+    # a damped system uses the eigendecomposition
+    sys.A = np.array([[0., 1.], [-1., -0.5]])
+    H = sys.frequency_response(omegas, inputs=['u1'], outputs=['y2'])
+    assert H.shape == (20, 1, 1)
+    assert np.allclose(H[:, 0, 0], 2. * s / (s**2 + 0.5 * s + 1.))
+
+def test_hessenberg_solve():
+    M = np.triu(np.random.random((6, 5, 5)) + 1j, -1)
+    # pivoting is needed where the diagonal is zero
+    M[:, 0, 0] = 0.
+    R = np.random.random((6, 5, 2))
+    X = ds._hessenberg_solve(M.copy(), R)
+    assert np.allclose(X, np.linalg.solve(M, R))
+
+def test_lqr_schedule():
+    from scipy.linalg import solve_continuous_are
+    sys = ds.LinearDynamicSystem()
+    sys.linear(np.zeros(2))
+    b = np.linspace(1., 3., 11)
+    Q = np.eye(2)
+    R = np.eye(1)
+    path = tempfile.mkdtemp()
+    try:
+        schedule = sys.lqr_schedule('b', b, Q, R, path=path)
+        for i, value in enumerate(b):
+            B = np.array([[0.], [value]])
+            P = solve_continuous_are(sys.A, B, Q, R)
+            assert np.allclose(schedule['P'][i], P)
+            assert np.allclose(schedule['K'][i], np.dot(B.T, P))
+        assert (schedule['eigenvalues'].real < 0.).all()
+        # the second design is read from the cache
+        cached = sys.lqr_schedule('b', b, Q, R, path=path)
+        assert (cached['K'] == schedule['K']).all()
+        assert len(os.listdir(path)) == 1
+        sys.lqr_schedule('b', b, 2. * Q, R, path=path)
+        assert len(os.listdir(path)) == 2
+    finally:
+        shutil.rmtree(path)
+
+def test_linear_trajectory():
+    sys = LinearDamped()
+    sys.linear(np.zeros(2))
+    X = np.random.random((7, 2))
+    sys.batchSize = 3
+    A, B, C, D = sys.linear_trajectory(X)
+    assert A.shape == (7, 2, 2) and D.shape == (7, 2, 1)
+    for i, x in enumerate(X):
+        sys.linear(x)
+        assert np.allclose(A[i], sys.A)
+        assert np.allclose(C[i], sys.C)
+    assert np.allclose(A, [[0., 1.], [-1., -0.5]])
+
+def test_profiling():
+    sys = ds.DynamicSystem()
+    sys.enable_profiling()
+    try:
+        sys.intOpts = dict(sys.intOpts, tf=0.5)
+        sys.simulate()
+        report = sys.profile_report()
+        assert report['methods']['simulate']['calls'] == 1
+        solver = report['solver']
+        assert solver['calls'] == len(sys.time_vector()) - 1
+        # the outputs evaluate f once per sample as well
+        assert solver['nfe'] > 0
+        assert (report['methods']['f']['calls'] == solver['nfe'] +
+                len(sys.time_vector()))
+        assert report['overhead'] > 0.
+    finally:
+        sys.disable_profiling()
+    assert 'f' not in sys.__dict__
+    assert sys.profile_report()['methods']['simulate']['calls'] == 1
+
+def test_lazy_imports():
+    # evaluating a model does not import the plotting or analysis packages
+    code = ('import sys, numpy, dynamicsystem\n'
+            'dynamicsystem.DynamicSystem().f(numpy.zeros(2), 0.)\n'
+            'print([m for m in ("matplotlib", "scipy") if m in sys.modules])')
+    path = os.path.dirname(os.path.abspath(ds.__file__))
+    out = subprocess.check_output([sys.executable, '-c', code],
+            env=dict(os.environ, PYTHONPATH=path))
+    assert out.decode().strip() == '[]'
+
+def test_envelope():
+    t = np.linspace(0., 10., 100001)
+    y = np.column_stack((np.sin(50. * t), t**2))
+    td, yd = ds.envelope(t, y, 300)
+    assert len(td) == len(yd) <= 600
+    assert (yd.min(axis=0) == y.min(axis=0)).all()
+    assert (yd.max(axis=0) == y.max(axis=0)).all()
+    # each pair holds the extremes of its bin, in order
+    assert (np.diff(yd[:, 1]) >= 0.).all()
+    assert (np.diff(td) >= 0.).all()
+    # short series are not decimated
+    assert ds.envelope(t[:500], y[:500, 0], 300)[1].shape == (500,)
+
+def test_cached_root_locus():
+    sys = LinearDamped()
+    sys.linear(np.zeros(2))
+    first = sys._cached_root_locus('c', -1., 1., 10)
+    assert sys._cached_root_locus('c', -1., 1., 10) is first
+    sys.set_parameters({'k' : 2.0, 'c' : 0.5})
+    try:
+        assert sys._cached_root_locus('c', -1., 1., 10) is not first
+    finally:
+        sys.set_parameters({'k' : 1.0, 'c' : 0.5})
@@ -0,0 +1,195 @@
+import gc
+import linecache
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+import weakref
+
+import numpy as np
+
+from altk import modelcompiler
+
+PENDULUM = """[Name]
+Pendulum
+
+[Integration Options]
+ti = 0.0, sec
+tf = 1.0, sec
+ts = 0.1, sec
+abserr = 1.0E-08
+relerr = 1.0E-07
+
+[Parameters]
+g = 9.81, meter/sec^2
+l = 2.0, meter
+
+[States]
+omega = 0.0
+theta = 0.5
+
+[Constants]
+z[1] = g/l
+
+[Inputs]
+torque = 0
+force = 0
+
+[Equations of Motion]
+thetap = omega
+omegap = torque + force - z[1]*sin(theta)
+
+[Dependent Variables]
+
+[Output Names]
+omega
+theta
+
+[Outputs]
+
+[Linear]
+"""
+
+def test_compile_text():
+    module = modelcompiler.compile_text(PENDULUM)
+    pendulum = module.Pendulum()
+    f = pendulum.f(np.array([0., 0.5]), 0.)
+    np.testing.assert_allclose(f, [-9.81 / 2. * np.sin(0.5), 0.])
+
+    linear = module.LinearPendulum()
+    linear.linear(np.zeros(2))
+    np.testing.assert_allclose(linear.A, [[0., -9.81 / 2.], [1., 0.]],
+            atol=1e-6)
+
+    # the classes can be pickled by reference
+    assert pickle.loads(pickle.dumps(module.LinearPendulum)) is \
+            module.LinearPendulum
+
+def test_compile_text_filename():
+    path = os.path.join(tempfile.gettempdir(), 'Pendulum.txt')
+    module = modelcompiler.compile_text(PENDULUM, filename=path)
+    code = module.Pendulum.f.__func__.__code__
+    # tracebacks show the generated source, not the lines of the text
+    assert code.co_filename == '<altk:Pendulum.txt>'
+    line = linecache.getline(code.co_filename, code.co_firstlineno)
+    assert line.strip().startswith('def f(')
+
+def test_compile_text_cache():
+    modelcompiler.compile_text(PENDULUM)
+    size = len(modelcompiler._codeCache)
+    first = modelcompiler.compile_text(PENDULUM)
+    second = modelcompiler.compile_text(PENDULUM)
+    assert len(modelcompiler._codeCache) == size
+    # the code is reused but each module has its own classes
+    assert first.Pendulum is not second.Pendulum
+    assert (first.Pendulum.f.__func__.__code__ is
+            second.Pendulum.f.__func__.__code__)
+    changed = modelcompiler.compile_text(PENDULUM.replace('l = 2.0', 'l = 1.0'))
+    assert changed.Pendulum.parameters['l'] == 1.0
+    assert len(modelcompiler._codeCache) == size + 1
+
+def test_model_handle():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'Pendulum.txt')
+    try:
+        with open(path, 'w') as f:
+            f.write(PENDULUM)
+        handle = modelcompiler.ModelHandle(path, linear=True, start=False)
+        assert handle.version == 1
+        assert handle.name == 'LinearPendulum'
+        handle.set_parameters({'g': 9.0, 'l': 2.0})
+        assert not handle.reload()
+
+        first = handle.model
+        with open(path, 'w') as f:
+            f.write(PENDULUM.replace('z[1] = g/l', 'z[1] = 2*g/l'))
+        assert handle.reload(force=True)
+        assert handle.version == 2
+        assert handle.model is not first
+        # the parameters carry over to the new version
+        assert handle.parameters['g'] == 9.0
+        handle.linear(np.zeros(2))
+        np.testing.assert_allclose(handle.A[0, 1], -9.0, rtol=1e-6)
+
+        # a broken file leaves the current version serving
+        with open(path, 'w') as f:
+            f.write(PENDULUM.replace('[States]', '[States]\nbroken'))
+        handle.interval = 0.01
+        handle.start()
+        for i in range(500):
+            if handle.error is not None:
+                break
+            time.sleep(0.01)
+        handle.stop()
+        assert handle.error is not None
+        assert handle.version == 2
+    finally:
+        shutil.rmtree(directory)
+
+def test_update_constants_after_constants():
+    pendulum = modelcompiler.compile_text(PENDULUM).Pendulum()
+    pendulum.update_constants()
+    pendulum.parameters['g'] = 20.0
+    pendulum.constants()
+    pendulum.parameters['g'] = 9.81
+    # the constants calculated by constants() are the ones being updated
+    pendulum.update_constants()
+    assert pendulum.z[1] == 9.81 / 2.0
+
+def test_model_hash():
+    first = modelcompiler.compile_text(PENDULUM).LinearPendulum()
+    second = modelcompiler.compile_text(PENDULUM.replace('z[1] = g/l',
+        'z[1] = 2*g/l')).LinearPendulum()
+    # models compiled from different text are told apart
+    assert first._model_hash() != second._model_hash()
+    assert (first._model_hash() ==
+            modelcompiler.compile_text(PENDULUM).LinearPendulum()._model_hash())
+
+def test_model_handle_releases_old_versions():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'Pendulum.txt')
+    try:
+        with open(path, 'w') as f:
+            f.write(PENDULUM)
+        handle = modelcompiler.ModelHandle(path, start=False)
+        handle.update_constants(['g'])
+        first = weakref.ref(type(handle.model))
+        modules = len(sys.modules)
+        for i in range(5):
+            with open(path, 'w') as f:
+                f.write(PENDULUM.replace('z[1] = g/l',
+                    'z[1] = {}*g/l'.format(i + 2)))
+            assert handle.reload(force=True)
+            handle.update_constants(['g'])
+        assert handle.version == 6
+        # nothing keeps the old classes alive
+        gc.collect()
+        assert len(sys.modules) == modules
+        assert first() is None
+
+        # an old instance which is still in use can be pickled
+        old = handle.model
+        with open(path, 'w') as f:
+            f.write(PENDULUM)
+        assert handle.reload(force=True)
+        assert old.__module__ in sys.modules
+        copy = pickle.loads(pickle.dumps(old))
+        assert type(copy) is type(old)
+        name = old.__module__
+        del old, copy
+        gc.collect()
+        assert name not in sys.modules
+        assert len(sys.modules) == modules
+    finally:
+        shutil.rmtree(directory)
+
+def test_set_parameters_after_direct_edit():
+    pendulum = modelcompiler.compile_text(PENDULUM.replace('z[1] = g/l\n',
+        'z[1] = g/l\nz[2] = 2*l\n')).Pendulum()
+    pendulum.parameters['l'] = 4.0
+    pendulum.set_parameters({'g': 8.0})
+    # the direct edit is applied along with the new value
+    assert pendulum.z[1] == 8.0 / 4.0
+    assert pendulum.z[2] == 8.0
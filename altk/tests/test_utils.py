@@ -1,7 +1,49 @@
 import alparse as al
+import alutils
 
 def test_replace_linear_mat():
     text = "aMat[0][1] = 12\nbMat[23][45] = x + z\n"
     matrixNames = ('aMat', 'bMat', 'cMat', 'dMat')
     replaced = al.replace_linear_mat(matrixNames, text)
     assert replaced == "A0, 1] = 12\nB[23, 45] = x + z\n"
+
+def test_write_linearization_pattern():
+    pattern = alutils.dependency_pattern("z1 = cos(q1)\n"
+                                         "q1' = u1\n"
+                                         "u1' = z1 * T1\n"
+                                         "y1 = q1", ['q1', 'u1', 'T1'])
+    assert pattern["u1'"] == set(['q1', 'T1'])
+    text = alutils.write_linearization(('A', 'B', 'C', 'D'), ('q1', 'u1'),
+            ('T1',), ('y1',), pattern=pattern)
+    assert text.splitlines()[:6] == ["A[1, 1] = 0",
+                                     "A[1, 2] = d(q1', u1)",
+                                     "",
+                                     "A[2, 1] = d(u1', q1)",
+                                     "A[2, 2] = 0",
+                                     ""]
+    assert "D[1, 1] = 0" in text
+    assert text.endswith('encode A, B, C, D')
+
+def test_write_linearization_parsed():
+    text = ("[Name]\nPendulum\n\n"
+            "[Parameters]\ng = 9.81, meter/sec^2\nl = 2.0, meter\n\n"
+            "[States]\nomega = 0.0\ntheta = 0.0\n\n"
+            "[Equations of Motion]\n"
+            "thetap = omega\n"
+            "z[1] = sin(theta)\n"
+            "omegap = -g/l*z[1] + torque\n")
+    className, inFileStrings, cFileStrings = al.parse_text(text)
+    pattern = alutils.dependency_pattern(cFileStrings[2],
+            ['omega', 'theta', 'torque'])
+    assert pattern["omega'"] == set(['theta', 'torque'])
+    text = alutils.write_linearization(('A', 'B', 'C', 'D'),
+            ('omega', 'theta'), ('torque',), (), pattern=pattern)
+    assert text.splitlines()[:9] == ["A[1, 1] = 0",
+                                     "A[1, 2] = d(omega', theta)",
+                                     "",
+                                     "A[2, 1] = d(theta', omega)",
+                                     "A[2, 2] = 0",
+                                     "",
+                                     "B[1, 1] = d(omega', torque)",
+                                     "",
+                                     "B[2, 1] = 0"]
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""Counts the arrays allocated by a model's f, inputs and outputs methods per
+call, and by simulate per time step, to check that the buffered paths do not
+allocate in the hot loop.
+
+The arrays are counted by wrapping the numpy constructors that the model code
+uses (`zeros`, `zeros_like`, `empty`, `empty_like`, `ones` and `array`), both
+in numpy itself and in the namespace of the model's module. The arrays made
+in compiled code can not be seen this way, so each call of odeint is counted
+as the two arrays it always makes: its copy of the times and the returned
+states. The work arrays of the solver itself are not counted.
+
+With odeint simulate makes a call per output interval, so at least two arrays
+are allocated per step. The fixed step rk4 integrator integrates in place and
+is shown for comparison.
+
+Usage::
+
+    python benchmarks/allocations.py [module:Class]
+
+The model defaults to the example altk.dynamicsystem:DynamicSystem.
+
+"""
+
+from __future__ import print_function
+
+import importlib
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+CONSTRUCTORS = ('zeros', 'zeros_like', 'empty', 'empty_like', 'ones', 'array')
+
+# the arrays each call of odeint allocates, the times and the result
+ODEINT_ARRAYS = 2
+
+class AllocationCounter(object):
+    """Replaces the numpy array constructors and odeint with counting
+    wrappers."""
+
+    def __init__(self, *modules):
+        self.modules = (np,) + modules
+        self.count = 0
+        self.originals = []
+
+    def wrap(self, function, arrays=1):
+        def counted(*args, **kwargs):
+            self.count += arrays
+            return function(*args, **kwargs)
+        return counted
+
+    def __enter__(self):
+        for module in self.modules:
+            for name in CONSTRUCTORS:
+                if name in module.__dict__:
+                    function = module.__dict__[name]
+                    self.originals.append((module, name, function))
+                    setattr(module, name, self.wrap(function))
+        # state_history imports odeint when it is called
+        import scipy.integrate
+        self.originals.append((scipy.integrate, 'odeint',
+            scipy.integrate.odeint))
+        scipy.integrate.odeint = self.wrap(scipy.integrate.odeint,
+                arrays=ODEINT_ARRAYS)
+        return self
+
+    def __exit__(self, *args):
+        for module, name, function in reversed(self.originals):
+            setattr(module, name, function)
+
+class Silence(object):
+    """Discards anything printed to stdout."""
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+def load_model(spec):
+    moduleName, className = spec.split(':')
+    module = importlib.import_module(moduleName)
+    return module, getattr(module, className)()
+
+def per_call(model, module, function, calls=1000):
+    with AllocationCounter(module) as counter:
+        for i in range(calls):
+            function(i)
+    return counter.count / float(calls)
+
+def main(spec='altk.dynamicsystem:DynamicSystem'):
+    module, model = load_model(spec)
+
+    x = np.array(model.initialConditions, dtype=float)
+    f = np.zeros_like(x)
+    u = np.zeros(len(model.inputNames))
+    y = np.zeros(len(model.outputNames))
+
+    results = [
+        ('f(x, t)', per_call(model, module, lambda i: model.f(x, 0.1 * i))),
+        ('f(x, t, out=f)', per_call(model, module,
+            lambda i: model.f(x, 0.1 * i, out=f))),
+        ('inputs(t)', per_call(model, module, lambda i: model.inputs(0.1 * i))),
+        ('inputs(t, out=u)', per_call(model, module,
+            lambda i: model.inputs(0.1 * i, out=u))),
+        ('outputs(x)', per_call(model, module, lambda i: model.outputs(x))),
+        ('outputs(x, out=y)', per_call(model, module,
+            lambda i: model.outputs(x, out=y))),
+        ]
+
+    model.intOpts['ti'] = 0.0
+    model.intOpts['tf'] = 10.0
+    model.intOpts['ts'] = 0.01
+    steps = len(model.time_vector())
+    for integrator in ('odeint', 'rk4'):
+        model.integrator = integrator
+        with AllocationCounter(module) as counter:
+            with Silence():
+                model.simulate()
+        results.append(('simulate {}, per step'.format(integrator),
+            counter.count / float(steps)))
+
+    print('Arrays allocated per call for {}'.format(model.name))
+    for name, count in results:
+        print('{:<28}{:>10.3f}'.format(name, count))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Measures the wall time of each step of the fixed step RK4 integrator, to
+check that a model can be stepped inside a real time frame, along with the
+time per sample of odeint for comparison.
+
+Usage::
+
+    python benchmarks/fixed_step.py [module:Class [dt [steps [frame]]]]
+
+The model defaults to the example altk.dynamicsystem:DynamicSystem, the step
+to 0.001 s, the number of steps to 10000 and the frame to 0.001 s.
+
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+
+import numpy as np
+
+from allocations import load_model, Silence
+
+from altk.dynamicsystem import RungeKutta4
+
+def step_times(model, dt, steps):
+    """Returns the wall time of each fixed step."""
+    clock = timeit.default_timer
+    rk4 = RungeKutta4(model.f, len(model.stateNames))
+    x = np.array(model.initialConditions, dtype=float)
+    times = np.zeros(steps)
+    for i in range(steps):
+        start = clock()
+        rk4.step(x, i * dt, dt)
+        times[i] = clock() - start
+    return times
+
+def odeint_time(model, dt, steps):
+    """Returns the mean wall time per sample of odeint."""
+    model.intOpts['ti'] = 0.0
+    model.intOpts['tf'] = dt * steps
+    model.intOpts['ts'] = dt
+    t = model.time_vector()
+    start = timeit.default_timer()
+    with Silence():
+        for x in model.state_history(t):
+            pass
+    return (timeit.default_timer() - start) / (len(t) - 1)
+
+def main(spec='altk.dynamicsystem:DynamicSystem', dt='0.001', steps='10000',
+        frame='0.001'):
+    dt, steps, frame = float(dt), int(steps), float(frame)
+    module, model = load_model(spec)
+
+    times = step_times(model, dt, steps)
+    us = 1e6 * times
+
+    print('Wall time per step for {} with dt = {} s'.format(model.name, dt))
+    print('{:<24}{:>12.2f} us'.format('rk4 mean', us.mean()))
+    print('{:<24}{:>12.2f} us'.format('rk4 median', np.median(us)))
+    print('{:<24}{:>12.2f} us'.format('rk4 99th percentile',
+        np.percentile(us, 99)))
+    print('{:<24}{:>12.2f} us'.format('rk4 max', us.max()))
+    print('{:<24}{:>12.2f} us'.format('odeint mean',
+        1e6 * odeint_time(model, dt, steps)))
+    print('{} of {} steps over the {} s frame'.format(
+        (times > frame).sum(), steps, frame))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Times the code generation steps of alparse which rewrite the identifiers
+of the parsed equations, on the sections of a model's .txt file.
+
+Usage::
+
+    python benchmarks/generator.py [model.txt [repeats]]
+
+The model defaults to the largest bundled model, WhipplePullForce.
+
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+from allocations import Silence
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from altk import alparse
+
+DEFAULT = os.path.join(ROOT, 'models', 'WhipplePullForce',
+        'WhipplePullForce.txt')
+
+def main(path=DEFAULT, repeats='20'):
+    repeats = int(repeats)
+    with open(path) as f:
+        className, inFileStrings, cFileStrings = alparse.parse_text(f.read())
+    intopts, parameters, states = inFileStrings
+    constants, odefunc, inputs = (cFileStrings[1], cFileStrings[2],
+            cFileStrings[4])
+    parameters = alparse.variable_declarations_to_dictionary(parameters)
+    stateNames = alparse.state_name_list(states)
+    inputNames = alparse.variables_values(inputs)[0]
+
+    cases = [
+        ('constants_lines', lambda: alparse.constants_lines(constants)),
+        ('eom_lines', lambda: alparse.eom_lines(parameters, stateNames,
+            inputNames, odefunc)),
+        ('extract_kinematical', lambda: alparse.extract_kinematical(odefunc,
+            stateNames)),
+        ]
+
+    print('{} ({} constants, {} equations of motion)'.format(
+        os.path.basename(path), len(constants.splitlines()),
+        len(odefunc.splitlines())))
+    for name, function in cases:
+        with Silence():
+            seconds = min(timeit.Timer(function).repeat(repeat=repeats,
+                number=1))
+        print('{:<24}{:>12.6f} s'.format(name, seconds))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Measures the time to import altk.dynamicsystem and evaluate the example
+system's equations of motion in a new interpreter, the start up cost of a
+headless worker, and lists the heavy packages that were imported on the way.
+
+Usage::
+
+    python benchmarks/import_time.py [repeats]
+
+"""
+
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+HEAVY = ('scipy', 'matplotlib', 'IPython', 'pickle', 'multiprocessing')
+
+CODE = '''
+import sys, timeit
+sys.path.insert(0, {root!r})
+start = timeit.default_timer()
+import numpy
+numpyTime = timeit.default_timer() - start
+from altk.dynamicsystem import DynamicSystem
+importTime = timeit.default_timer() - start
+system = DynamicSystem()
+system.f(numpy.zeros(2), 0.)
+firstTime = timeit.default_timer() - start
+heavy = sorted(set(m.split('.')[0] for m in sys.modules if m.split('.')[0] in
+    {heavy!r} and sys.modules[m] is not None))
+print(repr((numpyTime, importTime, firstTime, heavy)))
+'''
+
+def measure():
+    """Returns the times to import numpy, to import altk.dynamicsystem and to
+    the first evaluation of f, and the heavy packages imported."""
+    code = CODE.format(root=ROOT, heavy=HEAVY)
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return eval(out.decode().strip().splitlines()[-1])
+
+def main(repeats='5'):
+    results = [measure() for i in range(int(repeats))]
+    numpyTime = min(r[0] for r in results)
+    importTime = min(r[1] for r in results)
+    firstTime = min(r[2] for r in results)
+    heavy = results[-1][3]
+
+    print('Best of {} new interpreters'.format(repeats))
+    print('{:<32}{:>10.4f} s'.format('import numpy', numpyTime))
+    print('{:<32}{:>10.4f} s'.format('import altk.dynamicsystem',
+        importTime))
+    print('{:<32}{:>10.4f} s'.format('first f evaluation', firstTime))
+    print('Heavy packages imported: {}'.format(', '.join(heavy) or 'none'))
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
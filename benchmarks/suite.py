@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+"""Times the main operations on each model and compares the timings with a
+saved baseline, so that performance regressions are caught.
+
+For each model directory the suite times:
+
+- parse : parsing the Autolev .in and .c files, or the model's .txt file if
+  there is no .in file
+- generate : writing the Python class from the parsed files
+- compile : compiling the .txt file in memory with altk.modelcompiler, for
+  the models parsed from their .txt file
+- import cold, import warm : importing the model module in a new interpreter,
+  without and then with its compiled bytecode
+- f : a single evaluation of the equations of motion
+- simulate : a full simulation with the model's integration options
+- linear : a linearization about the initial conditions
+- root_locus : the eigenvalues over 20 values of the first parameter
+
+If the model module does not import, the last four cases are timed on the
+model compiled from its .txt file.
+
+The example altk.dynamicsystem system is always included. The operations
+which fail for a model, e.g. parsing without the .in and .txt files or the
+linearization of a model without a Linear class, are recorded as errors
+instead of timings, each case on its own.
+
+Usage::
+
+    python benchmarks/suite.py [--output results.json]
+        [--baseline baseline.json] [--tolerance 0.25] [model directories]
+
+The model directories default to those in models/. With a baseline, any
+timing more than the tolerance slower than the baseline is reported as a
+regression and the exit status is 1.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+from allocations import Silence
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from altk import alparse, modelcompiler
+from altk.dynamicsystem import _accepts_out
+
+def best_time(function, repeat=3, number=1):
+    """Returns the shortest mean time of the repeats of the function."""
+    timer = timeit.Timer(function)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def import_time(directory, moduleName, cold):
+    """Returns the time to import the module in a new interpreter."""
+    if cold:
+        for compiled in glob.glob(os.path.join(directory,
+                moduleName.replace('.', os.sep) + '.py[co]')):
+            os.remove(compiled)
+    code = ('import sys, timeit\n'
+            'sys.path[:0] = {!r}\n'
+            'start = timeit.default_timer()\n'
+            'import {}\n'
+            'sys.stdout.write(repr(timeit.default_timer() - start))\n').format(
+                    [directory, ROOT], moduleName)
+    process = subprocess.Popen([sys.executable, '-c', code],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    if process.returncode != 0:
+        # the last line is the exception, e.g. "ImportError: No module..."
+        raise ImportError(err.decode().strip().splitlines()[-1].split(': ',
+            1)[-1])
+    return float(out.decode().strip().splitlines()[-1])
+
+def parse_cases(directory, name):
+    """Returns the parse, generate and, for a .txt file, compile timing
+    functions of a model directory, and a temporary output directory."""
+    base = os.path.join(directory, name)
+    linear = ('A', 'B', 'C', 'D')
+    cases = {}
+
+    if (os.path.isfile(base + 'Dynamics.c') and
+            os.path.isfile(base + 'Dynamics.in')):
+        def parse():
+            with Silence():
+                inFileStrings = alparse.alparsein(base, 'Python')
+                cFileStrings = alparse.alparsec(base, 'Python', linear,
+                        alparse.state_name_list(inFileStrings[2]))
+            return inFileStrings, cFileStrings
+    elif os.path.isfile(base + '.txt'):
+        with open(base + '.txt') as f:
+            text = f.read()
+
+        def parse():
+            return alparse.parse_text(text)[1:]
+
+        def compile_text():
+            # the cached code would skip the generation and compilation
+            modelcompiler._codeCache.clear()
+            with Silence():
+                modelcompiler.compile_text(text, filename=base + '.txt')
+        cases['compile'] = compile_text
+    else:
+        raise IOError('There is no {0}Dynamics.in and {0}Dynamics.c or '
+                '{0}.txt.'.format(name))
+    cases['parse'] = parse
+
+    inFileStrings, cFileStrings = parse()
+    output = tempfile.mkdtemp()
+
+    def generate():
+        with Silence():
+            alparse.write_python(inFileStrings, cFileStrings, name, linear,
+                    directory=output)
+    cases['generate'] = generate
+
+    return cases, output
+
+def model_cases(module, name):
+    """Returns a function for each case of a model which sets the case up
+    and returns its timing function, so that a failing case does not stop
+    the others."""
+    cases = {}
+
+    def nonlinear():
+        with Silence():
+            model = getattr(module, name)()
+        return model, np.array(model.initialConditions, dtype=float)
+
+    def f():
+        model, x = nonlinear()
+        if not _accepts_out(model.f):
+            # models generated before f took out=
+            return lambda: model.f(x, 0.)
+        derivatives = np.zeros_like(x)
+        def f():
+            model.f(x, 0., out=derivatives)
+        return f
+    cases['f'] = f
+
+    def simulate():
+        model, x = nonlinear()
+        def simulate():
+            with Silence():
+                model.simulate()
+        return simulate
+    cases['simulate'] = simulate
+
+    def linearized():
+        linearClass = getattr(module, 'Linear' + name, None)
+        if linearClass is None:
+            raise AttributeError('There is no Linear{}.'.format(name))
+        with Silence():
+            linearModel = linearClass()
+        linearModel.linearCacheSize = 0
+        x = np.array(linearModel.initialConditions, dtype=float)
+        linearModel.linear(x)
+        return linearModel, x
+
+    def linear():
+        linearModel, x = linearized()
+        def linear():
+            linearModel.linear(x)
+        return linear
+    cases['linear'] = linear
+
+    def root_locus():
+        linearModel, x = linearized()
+        parameter = sorted(linearModel.parameters)[0]
+        value = linearModel.parameters[parameter]
+        def root_locus():
+            linearModel.root_locus(parameter, 0.9 * value, 1.1 * value,
+                    num=20)
+        return root_locus
+    cases['root_locus'] = root_locus
+
+    return cases
+
+def setup_time(setup, number=1):
+    """Returns the best time of the function returned by setup."""
+    return best_time(setup(), number=number)
+
+def benchmark(directory=None):
+    """Returns the timings and errors of a model directory, or of the example
+    system if the directory is None."""
+    timings = {}
+    errors = {}
+
+    def run(case, measure, **kwargs):
+        try:
+            timings[case] = measure(**kwargs)
+        except Exception as e:
+            errors[case] = '{}: {}'.format(e.__class__.__name__, e)
+
+    if directory is None:
+        name = 'DynamicSystem'
+        moduleDirectory, moduleName = ROOT, 'altk.dynamicsystem'
+    else:
+        directory = os.path.abspath(directory)
+        name = os.path.basename(directory.rstrip(os.sep))
+        moduleDirectory, moduleName = directory, name
+        try:
+            cases, output = parse_cases(directory, name)
+        except Exception as e:
+            errors['parse'] = '{}: {}'.format(e.__class__.__name__, e)
+        else:
+            try:
+                for case in ('parse', 'generate', 'compile'):
+                    if case in cases:
+                        run(case, best_time, function=cases[case])
+            finally:
+                shutil.rmtree(output)
+
+    run('import cold', import_time, directory=moduleDirectory,
+            moduleName=moduleName, cold=True)
+    run('import warm', import_time, directory=moduleDirectory,
+            moduleName=moduleName, cold=False)
+
+    try:
+        if moduleDirectory not in sys.path:
+            sys.path.insert(0, moduleDirectory)
+        with Silence():
+            module = importlib.import_module(moduleName)
+    except Exception as e:
+        errors['model'] = '{}: {}'.format(e.__class__.__name__, e)
+        # time the model compiled from its .txt file instead
+        module = None
+        if directory is not None:
+            path = os.path.join(directory, name + '.txt')
+            if os.path.isfile(path):
+                try:
+                    with Silence():
+                        module = modelcompiler.load_text(path)
+                except Exception as e:
+                    errors['model'] += '; {}.txt: {}: {}'.format(name,
+                            e.__class__.__name__, e)
+    if module is not None:
+        cases = model_cases(module, name)
+        for case in ('f', 'simulate', 'linear', 'root_locus'):
+            number = 1000 if case == 'f' else 1
+            run(case, setup_time, setup=cases[case], number=number)
+
+    return name, timings, errors
+
+def compare(results, baseline, tolerance):
+    """Returns a list of (model, case, baseline, time) for the timings which
+    are slower than the baseline by more than the tolerance."""
+    regressions = []
+    for name, timings in sorted(results['timings'].items()):
+        old = baseline['timings'].get(name, {})
+        for case, seconds in sorted(timings.items()):
+            if case in old and seconds > (1. + tolerance) * old[case]:
+                regressions.append((name, case, old[case], seconds))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directories', nargs='*',
+            help='the model directories, the default is those in models/')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare with these results')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+            help='the allowed relative slow down, default 0.25')
+    args = parser.parse_args(argv)
+
+    directories = args.directories
+    if not directories:
+        directories = sorted(os.path.dirname(p) for p in
+                glob.glob(os.path.join(ROOT, 'models', '*', '__init__.py')))
+
+    results = {'time' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python' : platform.python_version(),
+               'numpy' : np.__version__,
+               'timings' : {},
+               'errors' : {}}
+    for directory in [None] + directories:
+        name, timings, errors = benchmark(directory)
+        results['timings'][name] = timings
+        results['errors'][name] = errors
+        print(name)
+        for case, seconds in sorted(timings.items()):
+            print('    {:<16}{:>12.6f} s'.format(case, seconds))
+        for case, error in sorted(errors.items()):
+            print('    {:<16}{}'.format(case, error))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, case, old, new in regressions:
+            print('Regression: {} {} took {:.6f} s, the baseline is '
+                    '{:.6f} s'.format(name, case, new, old))
+        if regressions:
+            return 1
+        print('No regressions against {}.'.format(args.baseline))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())